@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import stat
+import struct
+import sys
+
+from cli import CliError, unlock, emit, PASSWORD_ENV
+from database import Database
+
+
+DEFAULT_CACHE_TTL = 300
+DEFAULT_CACHE_SIZE = 1000
+MAX_REQUEST_SIZE = 64 * 1024
+CACHE_SWEEP_INTERVAL = 30
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "secrets-agent", "agent.sock")
+    return os.path.join(os.path.expanduser("~"), ".secrets-agent", "agent.sock")
+
+
+def prepare_socket_directory(socket_path):
+    # Сокет лежит в собственном каталоге агента: несуществующий создается с правами 0700,
+    # существующий должен принадлежать пользователю и быть закрыт для остальных. Права общих
+    # каталогов (например, /tmp при --socket /tmp/agent.sock) агент не меняет.
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        raise CliError(f"Не удалось создать каталог сокета {directory}: {e}")
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise CliError(f"Каталог сокета {directory} должен принадлежать пользователю и иметь права 0700")
+    return directory
+
+
+class SecretsAgent:
+    # Долгоживущий процесс: хранилище открывается один раз, запросы get/list обслуживаются по
+    # Unix-сокету в формате JSON Lines. Расшифрованные записи держит кэш Database (ключ — имя
+    # и updated_at, поэтому измененная или удаленная запись не отдается); его размер и срок
+    # задаются при открытии Database.
+    def __init__(self, db, session):
+        self.db = db
+        self.session = session
+        self._server = None
+
+    async def handle_request(self, request):
+        loop = asyncio.get_running_loop()
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True}
+        if op == "get":
+            name = request.get("name")
+            if not isinstance(name, str):
+                return {"ok": False, "error": "Не указано название секрета"}
+            data = await loop.run_in_executor(None, self.db.get_secret, name, self.session)
+            if data is None:
+                return {"ok": False, "error": f"Секрет '{name}' не найден"}
+            return {"ok": True, "name": name, "data": data}
+        if op == "list":
+            search = request.get("search") or ''
+            limit = request.get("limit")
+            if not isinstance(search, str):
+                return {"ok": False, "error": "Поле search должно быть строкой"}
+            if limit is not None and (type(limit) is not int or limit < 0):
+                return {"ok": False, "error": "Поле limit должно быть неотрицательным целым числом"}
+            names = await loop.run_in_executor(None, self.db.search_secrets, search, limit)
+            return {"ok": True, "names": names}
+        return {"ok": False, "error": f"Неизвестная операция: {op}"}
+
+    async def handle_client(self, reader, writer):
+        try:
+            if not self._peer_allowed(writer.get_extra_info("socket")):
+                return
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("Запрос должен быть JSON-объектом")
+                    if self.session.is_unlocked:
+                        self.session.touch()
+                        response = await self.handle_request(request)
+                    else:
+                        response = {"ok": False, "error": "Хранилище заблокировано"}
+                except ValueError as e:
+                    response = {"ok": False, "error": f"Некорректный запрос: {e}"}
+                except Exception as e:
+                    # Ошибка одного запроса не должна обрывать соединение клиента
+                    response = {"ok": False, "error": f"Ошибка обработки запроса: {e}"}
+                writer.write(json.dumps(response, ensure_ascii=False).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _peer_allowed(self, sock):
+        # Кроме прав 0600 на сокет, на Linux дополнительно сверяем uid подключившегося процесса
+        if sock is None or not hasattr(socket, "SO_PEERCRED"):
+            return True
+        credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        _, uid, _ = struct.unpack("3i", credentials)
+        return uid == os.getuid()
+
+    async def _sweep_periodically(self):
+        # Блокировка по простою и удаление истекших записей кэша не ждут следующего запроса
+        while True:
+            await asyncio.sleep(CACHE_SWEEP_INTERVAL)
+            # is_unlocked сам блокирует сессию по истечении простоя, блокировка очищает кэш
+            if self.session.is_unlocked:
+                self.db.purge_expired_records()
+
+    async def serve(self, socket_path):
+        prepare_socket_directory(socket_path)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        old_umask = os.umask(0o177)
+        try:
+            self._server = await asyncio.start_unix_server(self.handle_client, path=socket_path,
+                                                           limit=MAX_REQUEST_SIZE)
+        finally:
+            os.umask(old_umask)
+        os.chmod(socket_path, 0o600)
+
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, lambda: stop.done() or stop.set_result(None))
+
+        sweeper = asyncio.ensure_future(self._sweep_periodically())
+        try:
+            print(f"Агент слушает {socket_path}", file=sys.stderr)
+            await stop
+        finally:
+            sweeper.cancel()
+            self._server.close()
+            await self._server.wait_closed()
+            self.session.lock()
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+
+def agent_request(request, socket_path=None):
+    # Синхронный клиент для скриптов: один запрос — один ответ
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path or default_socket_path())
+        client.sendall(json.dumps(request).encode() + b"\n")
+        with client.makefile("rb") as stream:
+            return json.loads(stream.readline())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="agent.py", description="Агент хранилища секретов на Unix-сокете")
+    parser.add_argument("--socket", default=default_socket_path(), help="путь к Unix-сокету")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="открыть хранилище и обслуживать запросы")
+    serve.add_argument("--db", default="secrets.db", help="путь к файлу хранилища")
+    serve.add_argument("--cache-ttl", type=float, default=DEFAULT_CACHE_TTL,
+                       help="сколько секунд держать расшифрованную запись в памяти")
+    serve.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="максимум записей в памяти")
+    serve.add_argument("--lock-after", type=float, default=0,
+                       help="заблокировать хранилище после стольких секунд простоя (0 — не блокировать)")
+    serve.add_argument("--password-fd", type=int, help="прочитать пароль из файлового дескриптора")
+    serve.add_argument("--password-file", help="прочитать пароль из первой строки файла")
+    serve.add_argument("--password-stdin", action="store_true", help="прочитать пароль из первой строки stdin")
+    serve.add_argument("--password-env", default=PASSWORD_ENV, help="переменная окружения с паролем")
+
+    get = commands.add_parser("get", help="запросить секрет у запущенного агента")
+    get.add_argument("name")
+    list_ = commands.add_parser("list", help="запросить список названий у запущенного агента")
+    list_.add_argument("--search", help="подстрока для поиска")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        with Database(args.db, cache_ttl=args.cache_ttl, cache_size=args.cache_size) as db:
+            try:
+                # Каталог сокета проверяется до запроса пароля
+                prepare_socket_directory(args.socket)
+                session = unlock(db, args)
+            except CliError as e:
+                emit(sys.stderr, {"error": str(e)})
+                return e.exit_code
+            session.idle_timeout = args.lock_after
+            agent = SecretsAgent(db, session)
+            asyncio.run(agent.serve(args.socket))
+        return 0
+
+    request = {"op": "get", "name": args.name} if args.command == "get" else {"op": "list", "search": args.search}
+    try:
+        response = agent_request(request, args.socket)
+    except OSError as e:
+        emit(sys.stderr, {"error": f"Агент недоступен: {e}"})
+        return 1
+    emit(sys.stdout, response)
+    return 0 if response.get("ok") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
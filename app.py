@@ -1,12 +1,84 @@
+import queue
 import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import messagebox
-from database import Database
+from database import Database, calibrate_kdf
 from dialogs import PasswordDialog, SecretPasswordDialog, AddSecretDialog
-from ui_components import LockScreen, Theme, RoundedButton
+from secret_types import SECRET_TYPES, get_secret_type, parse_tags
+from ui_components import FacetPane, LockScreen, Theme, RoundedButton, VirtualList
+
+
+SEARCH_DEBOUNCE_MS = 200
+IDLE_CHECK_MS = 5000
+JOB_POLL_MS = 30
+JOB_WORKERS = 2
+FACET_SECTIONS = [("type", "Типы"), ("folder", "Папки"), ("tag", "Теги")]
+FIELD_ICONS = {"host": "📍", "username": "👤", "password": "🔑", "token": "🔑", "private_key": "🗝",
+               "passphrase": "🔑", "certificate": "📜", "port": "🔌", "database": "🗄"}
+
+
+class BackgroundJobs:
+    # PBKDF2, расшифровка и запросы к БД выполняются в пуле потоков; результаты забираются
+    # в потоке Tk через root.after, потому что виджеты нельзя трогать из других потоков
+    def __init__(self, root, on_busy_change=None, max_workers=JOB_WORKERS):
+        self.root = root
+        self.on_busy_change = on_busy_change
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vault-job")
+        self._results = queue.Queue()
+        self._running = {}
+        self._poll_job = None
+
+    @property
+    def busy(self) -> bool:
+        return any(self._running.values())
+
+    def is_running(self, key) -> bool:
+        return key in self._running
+
+    def submit(self, key, func, on_success, on_error=None, track_busy=True) -> bool:
+        # Повторная отправка задачи с тем же ключом, пока первая не завершилась, игнорируется
+        if key in self._running:
+            return False
+        was_busy = self.busy
+        self._running[key] = track_busy
+        future = self._executor.submit(func)
+        future.add_done_callback(lambda f: self._results.put((key, f, on_success, on_error)))
+        if self._poll_job is None:
+            self._poll_job = self.root.after(JOB_POLL_MS, self._poll)
+        if self.busy != was_busy and self.on_busy_change:
+            self.on_busy_change(True)
+        return True
+
+    def _poll(self):
+        self._poll_job = None
+        while True:
+            try:
+                key, future, on_success, on_error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            was_busy = self.busy
+            self._running.pop(key, None)
+            if was_busy and not self.busy and self.on_busy_change:
+                self.on_busy_change(False)
+            error = future.exception()
+            if error is None:
+                on_success(future.result())
+            elif on_error:
+                on_error(error)
+            else:
+                print(f"Ошибка фоновой задачи {key}: {error}")
+        if self._running:
+            self._poll_job = self.root.after(JOB_POLL_MS, self._poll)
+
+    def shutdown(self):
+        if self._poll_job is not None:
+            self.root.after_cancel(self._poll_job)
+            self._poll_job = None
+        self._executor.shutdown(wait=False)
 
 
 class SecretWallet:
-    def __init__(self, root):
+    def __init__(self, root, db=None, lock_screen=None):
         self.root = root
         self.root.title("🔐 Storage of Secrets")
 
@@ -18,52 +90,107 @@ class SecretWallet:
             except:
                 print("Не удалось загрузить иконку приложения")
 
-        self.root.state('zoomed')
-        self.db = Database()
+        try:
+            self.root.state('zoomed')
+        except tk.TclError:
+            # Состояние 'zoomed' есть только в Windows и macOS, на X11 окно разворачивается атрибутом
+            self.root.attributes('-zoomed', True)
+        self.db = db if db is not None else Database()
+        self.jobs = BackgroundJobs(root, on_busy_change=self.set_busy)
+        self.session = None
+        self._search_job = None
+        self._search_generation = 0
+        self._last_search_term = None
+        self._status_before_busy = None
+        self.facet = (None, None)
         self.current_secret_name = None
         self.current_secret_data = None
         self.theme_manager = Theme()
         self.current_theme = self.theme_manager.get_theme()
-        self.lock_screen = LockScreen(root)
+        self.lock_screen = lock_screen or LockScreen(root)
         self.verify_master_password_on_startup()
 
     def verify_master_password_on_startup(self):
         if not self.db.is_master_password_set():
             self.lock_screen.destroy()
             messagebox.showinfo("Настройка", "Установите мастер-пароль для защиты ваших секретов.")
-
-            while True:
-                password = self.ask_password("Установка мастер-пароля", "Введите новый мастер-пароль:")
-                if not password:
-                    if messagebox.askyesno("Подтверждение",
-                                           "Без мастер-пароля вы не сможете сохранять секреты. Вы уверены?"):
-                        self.root.destroy()
-                        return
-                    continue
-
-                confirm = self.ask_password("Подтверждение", "Повторите мастер-пароль:")
-
-                if password == confirm:
-                    if self.db.set_master_password(password):
-                        messagebox.showinfo("Успех", "Мастер-пароль успешно установлен!")
-                        self.setup_ui()
-                        self.apply_theme()
-                        self.load_secrets()
-                        break
-                    else:
-                        messagebox.showerror("Ошибка", "Не удалось установить мастер-пароль")
-                else:
-                    messagebox.showerror("Ошибка", "Пароли не совпадают. Попробуйте снова.")
+            self.ask_new_master_password()
         else:
             password = self.ask_password("Мастер-пароль", "Введите мастер-пароль:")
-            if not password or not self.db.verify_master_password(password):
+            if not password:
                 messagebox.showerror("Ошибка", "Неверный мастер-пароль!")
                 self.root.destroy()
-            else:
+                return
+
+            def on_unlocked(session):
+                if session is None:
+                    messagebox.showerror("Ошибка", "Неверный мастер-пароль!")
+                    self.root.destroy()
+                    return
+                self.session = session
                 self.lock_screen.destroy()
-                self.setup_ui()
-                self.apply_theme()
-                self.load_secrets()
+                self.open_wallet()
+
+            self.jobs.submit("unlock", lambda: self.db.unlock(password), on_unlocked)
+
+    def ask_new_master_password(self):
+        while True:
+            password = self.ask_password("Установка мастер-пароля", "Введите новый мастер-пароль:")
+            if not password:
+                if messagebox.askyesno("Подтверждение",
+                                       "Без мастер-пароля вы не сможете сохранять секреты. Вы уверены?"):
+                    self.root.destroy()
+                    return
+                continue
+
+            confirm = self.ask_password("Подтверждение", "Повторите мастер-пароль:")
+
+            if password == confirm:
+                break
+            messagebox.showerror("Ошибка", "Пароли не совпадают. Попробуйте снова.")
+
+        def set_and_unlock():
+            # Стоимость KDF подбирается под эту машину, а не берется фиксированной
+            if not self.db.set_master_password(password, calibrate_kdf()):
+                return None
+            return self.db.unlock(password)
+
+        def on_done(session):
+            if session is None:
+                messagebox.showerror("Ошибка", "Не удалось установить мастер-пароль")
+                self.ask_new_master_password()
+                return
+            self.session = session
+            messagebox.showinfo("Успех", "Мастер-пароль успешно установлен!")
+            self.open_wallet()
+
+        self.jobs.submit("unlock", set_and_unlock, on_done)
+
+    def open_wallet(self):
+        self.setup_ui()
+        self.apply_theme()
+        self.load_secrets()
+        self.jobs.submit("facets", self.db.facet_counts, self.facet_pane.set_counts, track_busy=False)
+        self.root.after(IDLE_CHECK_MS, self.check_idle)
+
+    def check_idle(self):
+        # Сессия блокируется по таймауту бездействия, даже если к ней никто не обращается,
+        # а истекшие расшифрованные записи удаляются из кэша
+        if self.session is not None and not self.session.is_unlocked:
+            self.session = None
+            self.status_var.set("🔒 Хранилище заблокировано по бездействию")
+        self.db.purge_expired_records()
+        self.root.after(IDLE_CHECK_MS, self.check_idle)
+
+    def set_busy(self, busy):
+        self.root.config(cursor="watch" if busy else "")
+        if not hasattr(self, 'status_var'):
+            return
+        if busy:
+            self._status_before_busy = self.status_var.get()
+            self.status_var.set("⏳ Выполняется...")
+        elif self.status_var.get() == "⏳ Выполняется...":
+            self.status_var.set(self._status_before_busy or "Готов к работе")
 
     def ask_password(self, title, prompt):
         return PasswordDialog(self.root, title, prompt).show()
@@ -73,6 +200,37 @@ class SecretWallet:
             self.root, secret_name, action, self.current_theme
         ).show()
 
+    def with_session(self, secret_name, action, callback):
+        # Пока сессия не истекла по таймауту бездействия, мастер-пароль повторно не запрашивается.
+        # Иначе пароль спрашивается в потоке Tk, а PBKDF2 уходит в фоновый пул.
+        if self.session is not None and self.session.is_unlocked:
+            self.session.touch()
+            callback(self.session)
+            return
+
+        if self.jobs.is_running("unlock"):
+            return
+        master_password = self.ask_password_for_secret(secret_name, action)
+        if not master_password:
+            messagebox.showerror("Ошибка", "Неверный мастер-пароль!")
+            return
+
+        def on_unlocked(session):
+            if session is None:
+                messagebox.showerror("Ошибка", "Неверный мастер-пароль!")
+                return
+            self.session = session
+            callback(session)
+
+        self.jobs.submit("unlock", lambda: self.db.unlock(master_password), on_unlocked)
+
+    def with_secret(self, secret_name, action, callback):
+        def fetch(session):
+            self.jobs.submit(("secret", secret_name, action),
+                             lambda: self.db.get_secret(secret_name, session), callback)
+
+        self.with_session(secret_name, action, fetch)
+
     def setup_ui(self):
         main_frame = tk.Frame(self.root, bg=self.current_theme["bg"])
         main_frame.pack(fill=tk.BOTH, expand=True)
@@ -114,25 +272,35 @@ class SecretWallet:
         content_frame = tk.Frame(main_frame, bg=self.current_theme["bg"])
         content_frame.pack(fill=tk.BOTH, expand=True, padx=12, pady=8)
 
+        facet_frame = tk.Frame(content_frame, bg=self.current_theme["bg"])
+        facet_frame.pack(side=tk.LEFT, fill=tk.Y, padx=(0, 12))
+
+        tk.Label(facet_frame, text="Фильтры:", bg=self.current_theme["bg"],
+                 fg=self.current_theme["fg"], font=("Arial", 12)).pack(anchor=tk.W)
+
+        self.facet_pane = FacetPane(
+            facet_frame, FACET_SECTIONS, bg=self.current_theme["bg"],
+            labels={"type": lambda key: SECRET_TYPES[key].title if key in SECRET_TYPES else key})
+        self.facet_pane.pack(fill=tk.BOTH, expand=True, pady=(8, 0))
+        self.facet_pane.bind('<<FacetSelect>>', self.on_facet_select)
+
         list_frame = tk.Frame(content_frame, bg=self.current_theme["bg"])
         list_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
         tk.Label(list_frame, text="Сохраненные секреты:", bg=self.current_theme["bg"],
                  fg=self.current_theme["fg"], font=("Arial", 12)).pack(anchor=tk.W)
 
-        self.secrets_list = tk.Listbox(list_frame, width=50, height=15,
-                                       bg=self.current_theme["listbox_bg"], fg=self.current_theme["listbox_fg"],
-                                       font=("Arial", 11))
+        self.secrets_list = VirtualList(
+            list_frame, bg=self.current_theme["bg"],
+            listbox_options=dict(width=50, height=15,
+                                 bg=self.current_theme["listbox_bg"], fg=self.current_theme["listbox_fg"],
+                                 font=("Arial", 11)),
+            scrollbar_options=dict(bg=self.current_theme["scrollbar_bg"],
+                                   troughcolor=self.current_theme["scrollbar_trough"],
+                                   activebackground=self.current_theme["scrollbar_active"]))
         self.secrets_list.pack(fill=tk.BOTH, expand=True, pady=(8, 0))
         self.secrets_list.bind('<<ListboxSelect>>', self.on_secret_select)
 
-        scrollbar = tk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.secrets_list.yview,
-                                 bg=self.current_theme["scrollbar_bg"],
-                                 troughcolor=self.current_theme["scrollbar_trough"],
-                                 activebackground=self.current_theme["scrollbar_active"])
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.secrets_list.configure(yscrollcommand=scrollbar.set)
-
         details_frame = tk.LabelFrame(content_frame, text="Детали секрета", padx=12, pady=12,
                                       bg=self.current_theme["bg"], fg=self.current_theme["fg"],
                                       font=("Arial", 12))
@@ -165,7 +333,8 @@ class SecretWallet:
         action_buttons = [
             ("Копировать данные подключения", self.copy_connection_string, 220),
             ("Удалить выбранный", self.delete_secret, 150),
-            ("Показать подключение к БД", self.show_db_connection, 180)
+            ("Показать подключение к БД", self.show_db_connection, 180),
+            ("Сменить мастер-пароль", self.change_master_password, 170)
         ]
 
         for i, (text, command, width) in enumerate(action_buttons):
@@ -185,12 +354,17 @@ class SecretWallet:
 
     def exit_app(self):
         if messagebox.askyesno("Выход", "Вы уверены, что хотите выйти из приложения?"):
+            if self.session is not None:
+                self.session.lock()
+            self.jobs.shutdown()
+            self.db.close()
             self.root.destroy()
 
     def apply_theme(self):
         theme = self.current_theme
         self.root.configure(bg=theme["bg"])
         self.apply_theme_to_widget(self.root, theme)
+        self.facet_pane.apply_theme(theme)
 
     def apply_theme_to_widget(self, widget, theme):
         try:
@@ -227,13 +401,34 @@ class SecretWallet:
         if search_term is None:
             search_term = self.search_var.get()
 
-        secrets = self.db.search_secrets(search_term)
-        self.secrets_list.delete(0, tk.END)
+        # Прямая загрузка отменяет отложенный поиск и делает устаревшими его результаты
+        self._cancel_pending_search()
+        self._last_search_term = search_term
+        self._count_secrets(search_term)
+
+    def facet_filter(self):
+        kind, value = self.facet
+        if kind is None:
+            return {}
+        return {{"type": "secret_type"}.get(kind, kind): value}
+
+    def show_secrets(self, search_term, count):
+        # Список виртуальный: сюда передается только число совпадений, имена подгружаются страницами
+        # в фоне, как и само число
+        filters = self.facet_filter()
+        generation = self._search_generation
 
-        for secret in secrets:
-            self.secrets_list.insert(tk.END, secret)
+        def fetch(offset, limit, deliver):
+            def on_error(error):
+                print(f"Ошибка при загрузке списка секретов: {error}")
+                deliver([])
+
+            self.jobs.submit(("page", generation, offset),
+                             lambda: self.db.search_secrets(search_term, limit, offset, **filters),
+                             deliver, on_error, track_busy=False)
+
+        self.secrets_list.set_source(count, fetch)
 
-        count = len(secrets)
         if count == 0 and search_term:
             self.status_var.set(f"❌ Секрет '{search_term}' не найден")
             self.details_text.config(state=tk.NORMAL)
@@ -246,162 +441,248 @@ class SecretWallet:
             self.status_var.set(f"Загружено {count} секретов")
 
     def on_search(self, event=None):
-        self.load_secrets()
+        # Стрелки, модификаторы и прочие клавиши без изменения текста поиск не запускают
+        search_term = self.search_var.get()
+        if search_term == self._last_search_term:
+            return
+        self._last_search_term = search_term
+
+        self._cancel_pending_search()
+        self._search_job = self.root.after(SEARCH_DEBOUNCE_MS, self._run_search, search_term)
+
+    def _cancel_pending_search(self):
+        if self._search_job is not None:
+            self.root.after_cancel(self._search_job)
+            self._search_job = None
+
+    def _run_search(self, search_term):
+        self._search_job = None
+        self._count_secrets(search_term)
+
+    def _count_secrets(self, search_term):
+        self._search_generation += 1
+        generation = self._search_generation
+
+        def on_counted(count):
+            # Пока шел запрос, пользователь мог ввести новый: такие результаты отбрасываем
+            if generation != self._search_generation or search_term != self.search_var.get():
+                return
+            self.show_secrets(search_term, count)
+
+        filters = self.facet_filter()
+        self.jobs.submit(("search", generation), lambda: self.db.count_secrets(search_term, **filters), on_counted,
+                         track_busy=False)
+
+    def on_facet_select(self, event=None):
+        facet = self.facet_pane.selected()
+        if facet != self.facet:
+            self.facet = facet
+            self.load_secrets()
+
+    def update_facets(self, counts):
+        for kind, values in counts.items():
+            self.facet_pane.update_counts(kind, values)
+
+    def change_with_facets(self, secret_name, change):
+        # Выполняется в фоновом потоке. Пересчитываются только значения, которые запись имела
+        # до изменения и после него, а не все счетчики и не весь список.
+        before = self.db.get_facets(secret_name)
+        result = change()
+        affected = {kind: set(values) for kind, values in before.items()}
+        for kind, values in self.db.get_facets(secret_name).items():
+            affected.setdefault(kind, set()).update(values)
+        return result, self.db.facet_counts(affected)
 
     def add_secret(self):
         dialog = AddSecretDialog(self.root, self.current_theme)
         if dialog.result:
             name, secret_data = dialog.result
 
-            master_password = self.ask_password_for_secret(name, "сохранения")
-            if not master_password or not self.db.verify_master_password(master_password):
-                messagebox.showerror("Ошибка", "Неверный мастер-пароль!")
+            def on_saved(result):
+                saved, counts = result
+                self.update_facets(counts)
+                if saved:
+                    messagebox.showinfo("Успех", f"Секрет '{name}' успешно сохранен!")
+                    self.load_secrets()
+                    self.status_var.set(f"Секрет '{name}' сохранен")
+
+            self.with_session(name, "сохранения", lambda session: self.jobs.submit(
+                ("save", name),
+                lambda: self.change_with_facets(name, lambda: self.db.save_secret(name, secret_data, session)),
+                on_saved))
+
+    def change_master_password(self):
+        old_password = self.ask_password("Смена мастер-пароля", "Введите текущий мастер-пароль:")
+        if not old_password:
+            return
+        new_password = self.ask_password("Смена мастер-пароля", "Введите новый мастер-пароль:")
+        if not new_password:
+            return
+        if new_password != self.ask_password("Подтверждение", "Повторите новый мастер-пароль:"):
+            messagebox.showerror("Ошибка", "Пароли не совпадают.")
+            return
+        rekey = messagebox.askyesno("Смена мастер-пароля",
+                                    "Заменить также ключ шифрования и перешифровать все секреты?\n"
+                                    "Это дольше, но нужно, если старый ключ мог быть скомпрометирован.")
+
+        def on_rotated(session):
+            if session is None:
+                messagebox.showerror("Ошибка", "Не удалось сменить мастер-пароль: неверный текущий пароль!")
                 return
+            if self.session is not None:
+                self.session.lock()
+            self.session = session
+            self.status_var.set("Мастер-пароль изменен")
+            messagebox.showinfo("Успех", "Мастер-пароль успешно изменен!")
 
-            if self.db.save_secret(name, secret_data, master_password):
-                messagebox.showinfo("Успех", f"Секрет '{name}' успешно сохранен!")
-                self.load_secrets()
-                self.status_var.set(f"Секрет '{name}' сохранен")
+        self.jobs.submit("rotate", lambda: self.db.rotate_master_password(old_password, new_password, rekey=rekey),
+                         on_rotated)
 
     def on_secret_select(self, event=None):
-        selection = self.secrets_list.curselection()
-        if not selection:
+        secret_name = self.secrets_list.selected_name()
+        if not secret_name:
             return
 
-        secret_name = self.secrets_list.get(selection[0])
         self.show_secret_details(secret_name)
 
-    def show_secret_details(self, secret_name):
-        self.password_visible = False
-        self.toggle_password_btn.config(text="👁 Показать пароль")
-
-        master_password = self.ask_password_for_secret(secret_name, "просмотра")
-        if not master_password or not self.db.verify_master_password(master_password):
-            messagebox.showerror("Ошибка", "Неверный мастер-пароль!")
-            return
-
-        secret_data = self.db.get_secret(secret_name, master_password)
-        if secret_data is None:
-            self.details_text.config(state=tk.NORMAL)
-            self.details_text.delete(1.0, tk.END)
-            self.details_text.insert(1.0, f"❌ Секрет '{secret_name}' не найден")
-            self.details_text.config(state=tk.DISABLED)
-            self.status_var.set(f"Секрет '{secret_name}' не найден")
-            return
-
+    def render_secret_details(self, secret_name, secret_data, show_password=False):
         self.details_text.config(state=tk.NORMAL)
         self.details_text.delete(1.0, tk.END)
 
+        secret_type = get_secret_type(secret_data.get('type'))
         details = f"🔐 {secret_name}\n" + "=" * 40 + "\n\n"
-        details += f"📍 Хост: {secret_data.get('host', 'N/A')}\n"
-        details += f"👤 Логин: {secret_data.get('username', 'N/A')}\n"
-        details += f"🔑 Пароль: {'*' * len(secret_data.get('password', ''))}\n"
-        details += f"📊 Тип: {secret_data.get('type', 'Database')}\n"
+        for field in secret_type.fields:
+            value = str(secret_data.get(field.name) or '')
+            if field.secret and not show_password:
+                # Длинные ключи не разворачиваем в строку звездочек
+                value = '*' * (8 if field.multiline else len(value)) if value else ''
+            icon = FIELD_ICONS.get(field.name, "•")
+            if field.multiline and value and (show_password or not field.secret):
+                details += f"{icon} {field.label}:\n{value}\n"
+            else:
+                details += f"{icon} {field.label}: {value or 'N/A'}\n"
+        details += f"📊 Тип: {secret_type.title}\n"
+        if secret_data.get('folder'):
+            details += f"📁 Папка: {secret_data['folder']}\n"
+        tags = parse_tags(secret_data.get('tags'))
+        if tags:
+            details += f"🏷 Теги: {', '.join(tags)}\n"
 
         self.details_text.insert(1.0, details)
         self.details_text.config(state=tk.DISABLED)
 
-        self.current_secret_name = secret_name
-        self.current_secret_data = secret_data
-        self.status_var.set(f"Загружен секрет: {secret_name}")
+    def show_secret_details(self, secret_name):
+        self.password_visible = False
+        self.toggle_password_btn.config(text="👁 Показать пароль")
+
+        def on_loaded(secret_data):
+            if secret_data is None:
+                self.details_text.config(state=tk.NORMAL)
+                self.details_text.delete(1.0, tk.END)
+                self.details_text.insert(1.0, f"❌ Секрет '{secret_name}' не найден")
+                self.details_text.config(state=tk.DISABLED)
+                self.status_var.set(f"Секрет '{secret_name}' не найден")
+                return
+
+            self.render_secret_details(secret_name, secret_data)
+            self.current_secret_name = secret_name
+            self.current_secret_data = secret_data
+            self.status_var.set(f"Загружен секрет: {secret_name}")
+
+        self.with_secret(secret_name, "просмотра", on_loaded)
 
     def toggle_password_visibility(self):
         if not self.current_secret_name:
             return
 
         if self.password_visible:
-            self.show_secret_details(self.current_secret_name)
+            if self.current_secret_data is not None:
+                self.render_secret_details(self.current_secret_name, self.current_secret_data)
             self.toggle_password_btn.config(text="👁 Показать пароль")
             self.password_visible = False
         else:
-            master_password = self.ask_password_for_secret(self.current_secret_name, "просмотра пароля")
-            if not master_password or not self.db.verify_master_password(master_password):
-                messagebox.showerror("Ошибка", "Неверный мастер-пароль!")
-                return
+            secret_name = self.current_secret_name
 
-            secret_data = self.db.get_secret(self.current_secret_name, master_password)
-            if secret_data is None:
-                return
-
-            self.details_text.config(state=tk.NORMAL)
-            self.details_text.delete(1.0, tk.END)
-
-            details = f"🔐 {self.current_secret_name}\n" + "=" * 40 + "\n\n"
-            details += f"📍 Хост: {secret_data.get('host', 'N/A')}\n"
-            details += f"👤 Логин: {secret_data.get('username', 'N/A')}\n"
-            details += f"🔑 Пароль: {secret_data.get('password', '')}\n"
-            details += f"📊 Тип: {secret_data.get('type', 'Database')}\n"
-
-            self.details_text.insert(1.0, details)
-            self.details_text.config(state=tk.DISABLED)
+            def on_loaded(secret_data):
+                if secret_data is None or secret_name != self.current_secret_name:
+                    return
+                self.render_secret_details(secret_name, secret_data, show_password=True)
+                self.toggle_password_btn.config(text="🙈 Скрыть пароль")
+                self.password_visible = True
 
-            self.toggle_password_btn.config(text="🙈 Скрыть пароль")
-            self.password_visible = True
+            self.with_secret(secret_name, "просмотра пароля", on_loaded)
 
     def copy_connection_string(self):
         if not hasattr(self, 'current_secret_name') or not self.current_secret_name:
             messagebox.showwarning("Предупреждение", "Сначала выберите секрет")
             return
 
-        master_password = self.ask_password_for_secret(self.current_secret_name, "доступа к")
-        if not master_password or not self.db.verify_master_password(master_password):
-            messagebox.showerror("Ошибка", "Неверный мастер-пароль!")
-            return
+        secret_name = self.current_secret_name
 
-        secret_data = self.db.get_secret(self.current_secret_name, master_password)
-        if not secret_data:
-            messagebox.showerror("Ошибка", "Не удалось получить данные секрета")
-            return
+        def on_loaded(secret_data):
+            if not secret_data:
+                messagebox.showerror("Ошибка", "Не удалось получить данные секрета")
+                return
+
+            secret_type = get_secret_type(secret_data.get('type'))
+            if secret_type.key != 'database':
+                # Для ключей, токенов и сертификатов копируется основное секретное поле
+                field = next(field for field in secret_type.fields if field.required and field.name != 'username')
+                self.root.clipboard_clear()
+                self.root.clipboard_append(str(secret_data.get(field.name, '')))
+                self.status_var.set(f"{field.label} скопирован для {secret_name}")
+                messagebox.showinfo("Успех", f"{field.label} скопирован в буфер обмена!")
+                return
+
+            conn_string = f"host={secret_data.get('host', '')} port={secret_data.get('port', '')} "
+            conn_string += f"dbname={secret_data.get('database', '')} user={secret_data.get('username', '')} "
+            conn_string += f"password={secret_data.get('password', '')}"
 
-        conn_string = f"host={secret_data.get('host', '')} port={secret_data.get('port', '')} "
-        conn_string += f"dbname={secret_data.get('database', '')} user={secret_data.get('username', '')} "
-        conn_string += f"password={secret_data.get('password', '')}"
+            self.root.clipboard_clear()
+            self.root.clipboard_append(conn_string)
+            self.status_var.set(f"Строка подключения скопирована для {secret_name}")
+            messagebox.showinfo("Успех", "Строка подключения скопирована в буфер обмена!")
 
-        self.root.clipboard_clear()
-        self.root.clipboard_append(conn_string)
-        self.status_var.set(f"Строка подключения скопирована для {self.current_secret_name}")
-        messagebox.showinfo("Успех", "Строка подключения скопирована в буфер обмена!")
+        self.with_secret(secret_name, "доступа к", on_loaded)
 
     def delete_secret(self):
-        selection = self.secrets_list.curselection()
-        if not selection:
+        secret_name = self.secrets_list.selected_name()
+        if not secret_name:
             messagebox.showwarning("Предупреждение", "Сначала выберите секрет для удаления")
             return
 
-        secret_name = self.secrets_list.get(selection[0])
-
         if messagebox.askyesno("Подтверждение", f"Вы уверены, что хотите удалить секрет '{secret_name}'?"):
-            master_password = self.ask_password_for_secret(secret_name, "удаления")
-            if not master_password or not self.db.verify_master_password(master_password):
-                messagebox.showerror("Ошибка", "Неверный мастер-пароль!")
-                return
+            def on_deleted(result):
+                self.update_facets(result[1])
+                self.load_secrets()
+                self.details_text.config(state=tk.NORMAL)
+                self.details_text.delete(1.0, tk.END)
+                self.details_text.config(state=tk.DISABLED)
+                self.status_var.set(f"Секрет '{secret_name}' удален")
+                messagebox.showinfo("Успех", f"Секрет '{secret_name}' удален")
 
-            self.db.delete_secret(secret_name)
-            self.load_secrets()
-            self.details_text.config(state=tk.NORMAL)
-            self.details_text.delete(1.0, tk.END)
-            self.details_text.config(state=tk.DISABLED)
-            self.status_var.set(f"Секрет '{secret_name}' удален")
-            messagebox.showinfo("Успех", f"Секрет '{secret_name}' удален")
+            self.with_session(secret_name, "удаления", lambda session: self.jobs.submit(
+                ("delete", secret_name),
+                lambda: self.change_with_facets(secret_name, lambda: self.db.delete_secret(secret_name)),
+                on_deleted))
 
     def show_db_connection(self):
         if not hasattr(self, 'current_secret_name') or not self.current_secret_name:
             messagebox.showwarning("Предупреждение", "Сначала выберите секрет")
             return
 
-        master_password = self.ask_password_for_secret(self.current_secret_name, "просмотра")
-        if not master_password or not self.db.verify_master_password(master_password):
-            messagebox.showerror("Ошибка", "Неверный мастер-пароль!")
-            return
+        secret_name = self.current_secret_name
 
-        secret_data = self.db.get_secret(self.current_secret_name, master_password)
-        if not secret_data:
-            messagebox.showerror("Ошибка", "Не удалось получить данные секрета")
-            return
+        def on_loaded(secret_data):
+            if not secret_data:
+                messagebox.showerror("Ошибка", "Не удалось получить данные секрета")
+                return
+
+            conn_info = f"Подключение к БД:\n\n"
+            conn_info += f"Хост: {secret_data.get('host', 'N/A')}\n"
+            conn_info += f"Логин: {secret_data.get('username', 'N/A')}\n"
+            conn_info += f"Пароль: {secret_data.get('password', 'N/A')}"
 
-        conn_info = f"Подключение к БД:\n\n"
-        conn_info += f"Хост: {secret_data.get('host', 'N/A')}\n"
-        conn_info += f"Логин: {secret_data.get('username', 'N/A')}\n"
-        conn_info += f"Пароль: {secret_data.get('password', 'N/A')}"
+            messagebox.showinfo(f"Подключение: {secret_name}", conn_info)
 
-        messagebox.showinfo(f"Подключение: {self.current_secret_name}", conn_info)
\ No newline at end of file
+        self.with_secret(secret_name, "просмотра", on_loaded)
\ No newline at end of file
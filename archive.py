@@ -0,0 +1,184 @@
+import hashlib
+import hmac
+import json
+import os
+import struct
+import zlib
+
+from database import DEFAULT_CIPHER, KdfParams, derive_kdf, get_cipher
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Архив — последовательность кадров [длина: 4 байта big-endian][тип: 1 байт][данные].
+# H — открытый заголовок (JSON: KDF, соль, сжатие); C — порция записей в JSON Lines, сжатая и
+# зашифрованная своим ключом; E — итог (число порций и записей), тоже зашифрованный.
+# Ключ порции выводится из ключа архива, номера порции и хэша заголовка, поэтому перестановка,
+# подмена заголовка или обрезка архива обнаруживаются при чтении.
+ARCHIVE_MAGIC = b"SWARCH01"
+ARCHIVE_VERSION = 1
+FRAME_HEADER = b"H"
+FRAME_CHUNK = b"C"
+FRAME_END = b"E"
+FRAME_PREFIX = struct.Struct(">I")
+ARCHIVE_CHUNK_RECORDS = 1000
+ARCHIVE_CHUNK_BYTES = 1024 * 1024
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_ZSTD = "zstd"
+DEFAULT_COMPRESSION = COMPRESSION_ZSTD if zstandard is not None else COMPRESSION_ZLIB
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+def _compress(data: bytes, compression: str) -> bytes:
+    if compression == COMPRESSION_ZSTD:
+        return zstandard.ZstdCompressor().compress(data)
+    return zlib.compress(data, 6)
+
+
+def _decompress(data: bytes, compression: str) -> bytes:
+    # Размер распакованной порции ограничен, чтобы поврежденный архив не занял всю память
+    if compression == COMPRESSION_ZSTD:
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=MAX_FRAME_SIZE)
+    decompressor = zlib.decompressobj()
+    result = decompressor.decompress(data, MAX_FRAME_SIZE)
+    if decompressor.unconsumed_tail:
+        raise ArchiveError("Порция архива слишком велика")
+    return result
+
+
+def _frame_key(archive_key: bytes, header_digest: bytes, label: bytes, index: int) -> bytes:
+    return hmac.new(archive_key, label + index.to_bytes(8, "big") + header_digest, hashlib.sha256).digest()
+
+
+def _write_frame(stream, frame_type: bytes, payload: bytes):
+    stream.write(FRAME_PREFIX.pack(len(payload)) + frame_type)
+    stream.write(payload)
+
+
+def _read_frame(stream):
+    prefix = stream.read(FRAME_PREFIX.size + 1)
+    if not prefix:
+        return None, None
+    if len(prefix) < FRAME_PREFIX.size + 1:
+        raise ArchiveError("Архив обрезан")
+    (length,) = FRAME_PREFIX.unpack(prefix[:FRAME_PREFIX.size])
+    if length > MAX_FRAME_SIZE:
+        raise ArchiveError("Кадр архива слишком велик")
+    payload = stream.read(length)
+    if len(payload) < length:
+        raise ArchiveError("Архив обрезан")
+    return prefix[FRAME_PREFIX.size:], payload
+
+
+class ArchiveWriter:
+    # Записи копятся в буфере одной порции и сбрасываются в поток, поэтому память
+    # ограничена размером порции независимо от размера хранилища
+    def __init__(self, stream, password: str, kdf_params: KdfParams, compression=DEFAULT_COMPRESSION):
+        if compression == COMPRESSION_ZSTD and zstandard is None:
+            raise ArchiveError("Сжатие zstd недоступно: не установлен пакет zstandard")
+        self.stream = stream
+        self.compression = compression
+        self.records = 0
+        self.chunks = 0
+        self._buffer = []
+        self._buffer_size = 0
+
+        salt = os.urandom(16)
+        header = json.dumps({
+            "version": ARCHIVE_VERSION,
+            "kdf": list(kdf_params),
+            "salt": salt.hex(),
+            "compression": compression,
+        }).encode()
+        self._key = derive_kdf(password.encode(), salt, kdf_params)
+        self._header_digest = hashlib.sha256(header).digest()
+        stream.write(ARCHIVE_MAGIC)
+        _write_frame(stream, FRAME_HEADER, header)
+
+    def add(self, name, data):
+        line = json.dumps({"name": name, "data": data}, ensure_ascii=False).encode() + b"\n"
+        self._buffer.append(line)
+        self._buffer_size += len(line)
+        self.records += 1
+        if len(self._buffer) >= ARCHIVE_CHUNK_RECORDS or self._buffer_size >= ARCHIVE_CHUNK_BYTES:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        summary = json.dumps({"chunks": self.chunks, "records": self.records}).encode()
+        key = _frame_key(self._key, self._header_digest, FRAME_END, self.chunks)
+        _write_frame(self.stream, FRAME_END, DEFAULT_CIPHER.encrypt(summary, key))
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        payload = _compress(b"".join(self._buffer), self.compression)
+        key = _frame_key(self._key, self._header_digest, FRAME_CHUNK, self.chunks)
+        _write_frame(self.stream, FRAME_CHUNK, DEFAULT_CIPHER.encrypt(payload, key))
+        self.chunks += 1
+        self._buffer = []
+        self._buffer_size = 0
+
+
+def read_archive(stream, password: str):
+    # Генератор порций [(имя, данные)]: каждая порция проверяется и отдается сразу после чтения.
+    # Ошибка целостности или отсутствие итогового кадра — ArchiveError.
+    if stream.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+        raise ArchiveError("Файл не является архивом хранилища")
+    frame_type, header = _read_frame(stream)
+    if frame_type != FRAME_HEADER:
+        raise ArchiveError("Не найден заголовок архива")
+    try:
+        settings = json.loads(header)
+        kdf_params = KdfParams(*settings["kdf"])
+        salt = bytes.fromhex(settings["salt"])
+        compression = settings["compression"]
+    except (ValueError, KeyError, TypeError):
+        raise ArchiveError("Поврежден заголовок архива")
+    if settings.get("version") != ARCHIVE_VERSION:
+        raise ArchiveError(f"Неподдерживаемая версия архива: {settings.get('version')}")
+    if compression == COMPRESSION_ZSTD and zstandard is None:
+        raise ArchiveError("Архив сжат zstd: установите пакет zstandard")
+    if compression not in (COMPRESSION_ZLIB, COMPRESSION_ZSTD):
+        raise ArchiveError(f"Неизвестное сжатие: {compression}")
+
+    archive_key = derive_kdf(password.encode(), salt, kdf_params)
+    header_digest = hashlib.sha256(header).digest()
+    chunks = 0
+    records = 0
+    while True:
+        frame_type, payload = _read_frame(stream)
+        if frame_type is None:
+            raise ArchiveError("Архив обрезан: нет итогового кадра")
+        label = frame_type if frame_type in (FRAME_CHUNK, FRAME_END) else None
+        if label is None:
+            raise ArchiveError("Неизвестный кадр архива")
+        try:
+            data = get_cipher(payload[0]).decrypt(payload, _frame_key(archive_key, header_digest, label, chunks))
+        except Exception:
+            if chunks == 0:
+                raise ArchiveError("Неверный пароль архива или архив поврежден")
+            raise ArchiveError(f"Нарушена целостность порции {chunks}")
+
+        if frame_type == FRAME_END:
+            summary = json.loads(data)
+            if summary != {"chunks": chunks, "records": records}:
+                raise ArchiveError("Итог архива не совпадает с прочитанными данными")
+            if stream.read(1):
+                raise ArchiveError("Лишние данные после конца архива")
+            return
+
+        batch = []
+        for line in _decompress(data, compression).splitlines():
+            record = json.loads(line)
+            batch.append((record["name"], record["data"]))
+        chunks += 1
+        records += len(batch)
+        yield batch
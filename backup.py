@@ -0,0 +1,385 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import zlib
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from database import BUSY_TIMEOUT_MS
+
+
+# Резервные копии — цепочки файлов SQLite в одном каталоге: полный снимок через online backup API
+# и следующие за ним дельты с записями, изменившимися после предыдущего снимка (по журналу
+# изменений, а в хранилищах без журнала — по updated_at).
+# Записи копируются как есть, в зашифрованном виде: для снимка не нужен мастер-пароль,
+# а восстановленное хранилище открывается прежним паролем.
+BACKUP_PAGES_PER_STEP = 1024
+BACKUP_STEP_SLEEP = 0.005
+BACKUP_MAX_RESTARTS = 3
+# Запас на записи, у которых updated_at вычислен до начала снимка, а транзакция зафиксирована после
+WATERMARK_SLACK = timedelta(minutes=1)
+DEFAULT_KEEP_CHAINS = 7
+DEFAULT_MAX_DELTAS = 30
+ID_BATCH_SIZE = 10000
+SNAPSHOT_FULL = 'full'
+SNAPSHOT_DELTA = 'delta'
+
+# parent — имя предыдущего файла цепочки; ids — сжатый список id записей на момент снимка
+Snapshot = namedtuple('Snapshot', ['path', 'kind', 'created', 'watermark', 'records', 'user_version',
+                                   'key_digest', 'parent'])
+
+
+class BackupError(Exception):
+    pass
+
+
+class _BackupRestarted(Exception):
+    pass
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    return conn
+
+
+def _online_copy(source, target, progress=None):
+    # Копирование порциями страниц: между шагами источник отпускается, писатели не ждут конца копии.
+    # Запись в источник другим соединением заставляет SQLite начать копию заново; после нескольких
+    # перезапусков копируем одним шагом — в режиме WAL такое чтение писателей тоже не блокирует.
+    state = {'remaining': None, 'restarts': 0}
+
+    def step(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > BACKUP_MAX_RESTARTS:
+                raise _BackupRestarted()
+        state['remaining'] = remaining
+        if progress:
+            progress(total - remaining, total)
+
+    try:
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=step, sleep=BACKUP_STEP_SLEEP)
+    except _BackupRestarted:
+        source.backup(target)
+
+
+def _read_ids(conn, schema='main'):
+    ids = array('q')
+    cursor = conn.execute(f'SELECT id FROM {schema}.secrets ORDER BY id')
+    while True:
+        rows = cursor.fetchmany(ID_BATCH_SIZE)
+        if not rows:
+            return ids
+        ids.extend(row[0] for row in rows)
+
+
+def _pack_ids(ids) -> bytes:
+    # Разности соседних id в little-endian, сжатые zlib: подряд идущие id занимают считанные байты
+    deltas = array('q', [0]) * len(ids)
+    previous = 0
+    for i, record_id in enumerate(ids):
+        deltas[i] = record_id - previous
+        previous = record_id
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    return zlib.compress(deltas.tobytes(), 6)
+
+
+def _unpack_ids(blob: bytes):
+    deltas = array('q', zlib.decompress(blob))
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    ids = array('q', [0]) * len(deltas)
+    previous = 0
+    for i, delta in enumerate(deltas):
+        previous += delta
+        ids[i] = previous
+    return ids
+
+
+def _removed_ids(previous, current):
+    # Оба списка отсортированы: удаленные id находятся одним проходом слиянием
+    removed = []
+    j = 0
+    for record_id in previous:
+        while j < len(current) and current[j] < record_id:
+            j += 1
+        if j == len(current) or current[j] != record_id:
+            removed.append((record_id,))
+    return removed
+
+
+def _vault_state(conn, schema='main'):
+    # Версия схемы и отпечаток обернутого ключа данных: при их смене записи могли быть
+    # перешифрованы без изменения updated_at, и дельта была бы неполной
+    user_version = conn.execute(f'PRAGMA {schema}.user_version').fetchone()[0]
+    row = conn.execute(f'SELECT kek_salt, wrapped_key FROM {schema}.vault_keys WHERE id = 1').fetchone()
+    key_digest = hashlib.sha256(row[0] + row[1]).hexdigest() if row else ''
+    return user_version, key_digest
+
+
+def _has_table(conn, schema, name):
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                        (name,)).fetchone() is not None
+
+
+def _log_seq(conn, schema='main'):
+    if not _has_table(conn, schema, 'change_log'):
+        return 0
+    return conn.execute(f'SELECT coalesce(max(seq), 0) FROM {schema}.change_log').fetchone()[0]
+
+
+def _write_info(conn, info, ids):
+    conn.execute('CREATE TABLE backup_info (key TEXT PRIMARY KEY, value)')
+    conn.executemany('INSERT INTO backup_info (key, value) VALUES (?, ?)',
+                     list(info.items()) + [('ids', _pack_ids(ids))])
+
+
+class BackupStore:
+    def __init__(self, backup_dir, keep_chains=DEFAULT_KEEP_CHAINS, max_deltas=DEFAULT_MAX_DELTAS):
+        self.backup_dir = backup_dir
+        self.keep_chains = keep_chains
+        self.max_deltas = max_deltas
+
+    def snapshots(self) -> list:
+        # Снимки в порядке создания: имя файла начинается с времени снимка
+        if not os.path.isdir(self.backup_dir):
+            return []
+        result = []
+        for file_name in sorted(os.listdir(self.backup_dir)):
+            if file_name.endswith('.db'):
+                result.append(self._read_snapshot(os.path.join(self.backup_dir, file_name)))
+        return result
+
+    def snapshot(self, db_path, full=False, progress=None) -> Snapshot:
+        # Дельта, если есть к чему ее добавить; полный снимок — для первой копии, после смены схемы
+        # или ключа и когда цепочка достигла max_deltas. После снимка применяется политика хранения.
+        os.makedirs(self.backup_dir, exist_ok=True)
+        snapshots = self.snapshots()
+        chain = self._chains(snapshots)[-1] if snapshots else []
+        source = _connect(db_path)
+        try:
+            state = (chain[-1].user_version, chain[-1].key_digest) if chain else None
+            if not full and chain and len(chain) <= self.max_deltas and _vault_state(source) == state:
+                snapshot = self._write_delta(source, db_path, chain[-1])
+            else:
+                snapshot = self._write_full(source, progress)
+        finally:
+            source.close()
+        self.prune()
+        return snapshot
+
+    def restore(self, target_path, snapshot_name=None) -> Snapshot:
+        # Полный снимок копируется в новый файл, затем по порядку накатываются дельты цепочки
+        # до snapshot_name (по умолчанию до последнего снимка)
+        if os.path.exists(target_path):
+            raise BackupError(f"Файл {target_path} уже существует")
+        chain = self._chain_until(snapshot_name)
+        temp_path = f'{target_path}.tmp'
+        source = _connect(chain[0].path)
+        target = _connect(temp_path)
+        try:
+            source.backup(target)
+            target.execute('DROP TABLE backup_info')
+            for delta in chain[1:]:
+                self._apply_delta(target, delta)
+            if len(chain) > 1 and _has_table(target, 'main', 'merkle_meta'):
+                # Дельты накатываются без ключа: индекс целостности перестроится при разблокировке
+                target.execute('DELETE FROM merkle_meta')
+            target.execute('PRAGMA journal_mode=WAL')
+        except Exception:
+            target.close()
+            os.remove(temp_path)
+            raise
+        finally:
+            source.close()
+        target.close()
+        os.replace(temp_path, target_path)
+        return chain[-1]
+
+    def prune(self) -> list:
+        # Хранятся keep_chains последних цепочек (полный снимок и его дельты) целиком
+        removed = []
+        chains = self._chains(self.snapshots())
+        for chain in chains[:max(0, len(chains) - self.keep_chains)]:
+            for snapshot in chain:
+                os.remove(snapshot.path)
+                removed.append(os.path.basename(snapshot.path))
+        return removed
+
+    def _new_path(self, created, kind):
+        return os.path.join(self.backup_dir, f"{created:%Y%m%d-%H%M%S-%f}-{kind}.db")
+
+    def _write_full(self, source, progress):
+        created = datetime.now()
+        path = self._new_path(created, SNAPSHOT_FULL)
+        temp_path = f'{path}.tmp'
+        target = _connect(temp_path)
+        try:
+            _online_copy(source, target, progress)
+            # Копия — самостоятельный файл без журнала WAL рядом
+            target.execute('PRAGMA journal_mode=DELETE')
+            user_version, key_digest = _vault_state(target)
+            ids = _read_ids(target)
+            info = {
+                'kind': SNAPSHOT_FULL,
+                'created': created.isoformat(' '),
+                'watermark': (created - WATERMARK_SLACK).isoformat(' '),
+                'records': len(ids),
+                'user_version': user_version,
+                'key_digest': key_digest,
+                'parent': None,
+                'log_seq': _log_seq(target),
+            }
+            target.execute('BEGIN')
+            _write_info(target, info, ids)
+            target.execute('COMMIT')
+        except Exception:
+            target.close()
+            os.remove(temp_path)
+            raise
+        target.close()
+        os.replace(temp_path, path)
+        return self._read_snapshot(path)
+
+    def _write_delta(self, source, db_path, parent):
+        # Все чтения из хранилища идут в одной транзакции, поэтому дельта согласована
+        created = datetime.now()
+        path = self._new_path(created, SNAPSHOT_DELTA)
+        temp_path = f'{path}.tmp'
+        target = _connect(temp_path)
+        try:
+            target.execute('ATTACH DATABASE ? AS vault', (db_path,))
+            target.execute('BEGIN')
+            has_log = _has_table(target, 'vault', 'change_log')
+            parent_seq = self._read_info_value(parent.path, 'log_seq') or 0
+            if has_log:
+                # Записи, принятые синхронизацией, сохраняют более ранний updated_at копии-источника,
+                # поэтому измененные записи выбираются по seq журнала, а не по времени
+                target.execute('''
+                    CREATE TABLE records AS SELECT * FROM vault.secrets
+                    WHERE name IN (SELECT name FROM vault.change_log WHERE seq > ?)
+                ''', (parent_seq,))
+            else:
+                target.execute('CREATE TABLE records AS SELECT * FROM vault.secrets WHERE updated_at >= ?',
+                               (parent.watermark,))
+            target.execute('CREATE TABLE record_tags (secret_id INTEGER NOT NULL, tag TEXT NOT NULL)')
+            if _has_table(target, 'vault', 'secret_tags'):
+                target.execute('''
+                    INSERT INTO record_tags (secret_id, tag)
+                    SELECT st.secret_id, t.name FROM vault.secret_tags st JOIN vault.tags t ON t.id = st.tag_id
+                    WHERE st.secret_id IN (SELECT id FROM records)
+                ''')
+            target.execute('CREATE TABLE master_password AS SELECT * FROM vault.master_password')
+            target.execute('CREATE TABLE vault_keys AS SELECT * FROM vault.vault_keys')
+            # Изменения журнала для синхронизации (строки с seq после снимка) заменяют прежние строки тех же записей,
+            # таблицы копий переносятся целиком
+            if has_log:
+                target.execute('CREATE TABLE change_log AS SELECT * FROM vault.change_log WHERE seq > ?',
+                               (parent_seq,))
+                target.execute('CREATE TABLE replica AS SELECT * FROM vault.replica')
+                target.execute('CREATE TABLE sync_peers AS SELECT * FROM vault.sync_peers')
+            user_version, key_digest = _vault_state(target, 'vault')
+            ids = _read_ids(target, 'vault')
+            target.execute('CREATE TABLE deleted_ids (id INTEGER PRIMARY KEY)')
+            target.executemany('INSERT INTO deleted_ids (id) VALUES (?)',
+                               _removed_ids(_unpack_ids(self._read_info_value(parent.path, 'ids')), ids))
+            changed = target.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+            info = {
+                'kind': SNAPSHOT_DELTA,
+                'created': created.isoformat(' '),
+                'watermark': (created - WATERMARK_SLACK).isoformat(' '),
+                'records': changed,
+                'user_version': user_version,
+                'key_digest': key_digest,
+                'parent': os.path.basename(parent.path),
+                'log_seq': _log_seq(target, 'vault'),
+            }
+            _write_info(target, info, ids)
+            target.execute('COMMIT')
+            target.execute('DETACH DATABASE vault')
+        except Exception:
+            target.close()
+            os.remove(temp_path)
+            raise
+        target.close()
+        os.replace(temp_path, path)
+        return self._read_snapshot(path)
+
+    def _apply_delta(self, target, delta):
+        # Удаления и замены идут через DELETE + INSERT, чтобы сработали триггеры поиска и тегов
+        target.execute('ATTACH DATABASE ? AS delta', (delta.path,))
+        try:
+            target.execute('BEGIN')
+            target.execute('''
+                DELETE FROM secrets
+                WHERE id IN (SELECT id FROM delta.deleted_ids)
+                   OR id IN (SELECT id FROM delta.records)
+                   OR name IN (SELECT name FROM delta.records)
+            ''')
+            target.execute('INSERT INTO secrets SELECT * FROM delta.records')
+            if _has_table(target, 'main', 'secret_tags'):
+                target.execute('INSERT OR IGNORE INTO tags (name) SELECT tag FROM delta.record_tags')
+                target.execute('''
+                    INSERT OR IGNORE INTO secret_tags (secret_id, tag_id)
+                    SELECT rt.secret_id, t.id FROM delta.record_tags rt JOIN tags t ON t.name = rt.tag
+                ''')
+            target.execute('DELETE FROM master_password')
+            target.execute('INSERT INTO master_password SELECT * FROM delta.master_password')
+            target.execute('DELETE FROM vault_keys')
+            target.execute('INSERT INTO vault_keys SELECT * FROM delta.vault_keys')
+            if _has_table(target, 'delta', 'change_log'):
+                # В журнале одна строка на запись: новая версия из дельты заменяет прежнюю
+                target.execute('INSERT OR REPLACE INTO change_log SELECT * FROM delta.change_log')
+                for table in ('replica', 'sync_peers'):
+                    target.execute(f'DELETE FROM {table}')
+                    target.execute(f'INSERT INTO {table} SELECT * FROM delta.{table}')
+            target.execute('COMMIT')
+        except Exception:
+            target.execute('ROLLBACK')
+            raise
+        finally:
+            target.execute('DETACH DATABASE delta')
+
+    def _chains(self, snapshots):
+        # Цепочка начинается с полного снимка; дельты без полного снимка перед ними не восстановить
+        chains = []
+        for snapshot in snapshots:
+            if snapshot.kind == SNAPSHOT_FULL:
+                chains.append([snapshot])
+            elif chains and snapshot.parent == os.path.basename(chains[-1][-1].path):
+                chains[-1].append(snapshot)
+        return chains
+
+    def _chain_until(self, snapshot_name):
+        for chain in reversed(self._chains(self.snapshots())):
+            if snapshot_name is None:
+                return chain
+            for i, snapshot in enumerate(chain):
+                if os.path.basename(snapshot.path) == snapshot_name:
+                    return chain[:i + 1]
+        if snapshot_name is None:
+            raise BackupError(f"В каталоге {self.backup_dir} нет полных снимков")
+        raise BackupError(f"Снимок {snapshot_name} не найден или его цепочка неполна")
+
+    def _read_snapshot(self, path) -> Snapshot:
+        conn = sqlite3.connect(path)
+        try:
+            info = dict(conn.execute("SELECT key, value FROM backup_info WHERE key != 'ids'").fetchall())
+        except sqlite3.DatabaseError as e:
+            raise BackupError(f"Файл {path} не является снимком хранилища: {e}")
+        finally:
+            conn.close()
+        return Snapshot(path, info['kind'], info['created'], info['watermark'], info['records'],
+                        info['user_version'], info['key_digest'], info['parent'])
+
+    def _read_info_value(self, path, key):
+        conn = sqlite3.connect(path)
+        try:
+            row = conn.execute('SELECT value FROM backup_info WHERE key = ?', (key,)).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
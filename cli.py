@@ -0,0 +1,458 @@
+import argparse
+import getpass
+import json
+import os
+import sys
+from contextlib import redirect_stdout
+
+from database import DEFAULT_KDF_TARGET_SECONDS, KDF_PBKDF2, KDF_SCRYPT, Database, calibrate_kdf
+from secret_types import SECRET_TYPES
+
+
+PASSWORD_ENV = "SECRETS_MASTER_PASSWORD"
+NEW_PASSWORD_ENV = "SECRETS_NEW_MASTER_PASSWORD"
+IMPORT_BATCH_SIZE = 1000
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_AUTH = 2
+
+
+class CliError(Exception):
+    def __init__(self, message, exit_code=EXIT_ERROR):
+        super().__init__(message)
+        self.exit_code = exit_code
+
+
+def read_password(args):
+    # Источники по приоритету: дескриптор, файл, stdin, переменная окружения, интерактивный ввод
+    if args.password_fd is not None:
+        with os.fdopen(args.password_fd, 'r', closefd=False) as stream:
+            return stream.readline().rstrip('\r\n')
+    if args.password_file:
+        with open(args.password_file, 'r', encoding='utf-8') as stream:
+            return stream.readline().rstrip('\r\n')
+    if args.password_stdin:
+        return sys.stdin.readline().rstrip('\r\n')
+    password = os.environ.get(args.password_env)
+    if password:
+        return password
+    if sys.stdin.isatty():
+        return getpass.getpass("Мастер-пароль: ", stream=sys.stderr)
+    raise CliError("Мастер-пароль не передан", EXIT_AUTH)
+
+
+def read_new_password(args):
+    if args.new_password_file:
+        with open(args.new_password_file, 'r', encoding='utf-8') as stream:
+            return stream.readline().rstrip('\r\n')
+    password = os.environ.get(NEW_PASSWORD_ENV)
+    if password:
+        return password
+    if sys.stdin.isatty():
+        password = getpass.getpass("Новый мастер-пароль: ", stream=sys.stderr)
+        if password != getpass.getpass("Повторите новый мастер-пароль: ", stream=sys.stderr):
+            raise CliError("Пароли не совпадают")
+        return password
+    raise CliError("Новый мастер-пароль не передан", EXIT_AUTH)
+
+
+def unlock(db, args):
+    session = db.unlock(read_password(args))
+    if session is None:
+        raise CliError("Неверный мастер-пароль", EXIT_AUTH)
+    return session
+
+
+def emit(out, value):
+    out.write(json.dumps(value, ensure_ascii=False))
+    out.write("\n")
+
+
+def cmd_init(db, args, out):
+    if db.is_master_password_set():
+        raise CliError(f"Хранилище {args.db} уже создано")
+    password = read_password(args)
+    if not password:
+        raise CliError("Мастер-пароль не может быть пустым")
+    kdf_params = kdf_params_from_args(args) or calibrate_kdf()
+    if not db.set_master_password(password, kdf_params):
+        raise CliError("Не удалось создать хранилище")
+    emit(out, {"db": args.db, "created": True, "kdf": kdf_params._asdict()})
+
+
+def cmd_get(db, args, out):
+    session = unlock(db, args)
+    data = db.get_secret(args.name, session)
+    if data is None:
+        raise CliError(f"Секрет '{args.name}' не найден")
+    emit(out, {"name": args.name, "data": data})
+
+
+def cmd_put(db, args, out):
+    if args.data_file:
+        if args.data_file == '-' and args.password_stdin:
+            raise CliError("stdin уже используется для мастер-пароля")
+        stream = sys.stdin if args.data_file == '-' else open(args.data_file, 'r', encoding='utf-8')
+        with stream:
+            data = json.load(stream)
+    elif args.data is not None:
+        data = json.loads(args.data)
+    else:
+        raise CliError("Укажите данные секрета через --data или --data-file")
+
+    session = unlock(db, args)
+    if not db.save_secret(args.name, data, session):
+        raise CliError(f"Не удалось сохранить секрет '{args.name}'")
+    emit(out, {"name": args.name, "saved": True})
+
+
+def cmd_list(db, args, out):
+    emit(out, db.search_secrets(args.search or '', args.limit, secret_type=args.type, tag=args.tag, host=args.host,
+                                   folder=args.folder))
+
+
+def cmd_delete(db, args, out):
+    unlock(db, args)
+    if not db.delete_secret(args.name):
+        raise CliError(f"Секрет '{args.name}' не найден")
+    emit(out, {"name": args.name, "deleted": True})
+
+
+def kdf_params_from_args(args, db=None):
+    # --kdf или --target-ms подбирают стоимость KDF под эту машину, иначе параметры не меняются
+    if args.kdf is None and args.target_ms is None:
+        return None
+    kdf = args.kdf or (db.get_kdf_params().kdf if db is not None else KDF_PBKDF2)
+    target_ms = args.target_ms if args.target_ms is not None else DEFAULT_KDF_TARGET_SECONDS * 1000
+    if target_ms <= 0:
+        raise CliError("--target-ms должно быть положительным")
+    return calibrate_kdf(kdf, target_ms / 1000)
+
+
+def add_kdf_arguments(command):
+    command.add_argument("--kdf", choices=[KDF_PBKDF2, KDF_SCRYPT], help="функция формирования ключа")
+    command.add_argument("--target-ms", type=float,
+                         help="подобрать стоимость KDF на это время вычисления, мс "
+                              f"(по умолчанию {DEFAULT_KDF_TARGET_SECONDS * 1000:g})")
+
+
+def cmd_passwd(db, args, out):
+    old_password = read_password(args)
+    new_password = read_new_password(args)
+    if not new_password:
+        raise CliError("Новый мастер-пароль не может быть пустым")
+    kdf_params = kdf_params_from_args(args, db)
+
+    def progress(done, total):
+        print(f"Перешифровано {done} из {total}", file=sys.stderr)
+
+    session = db.rotate_master_password(old_password, new_password, progress if args.rekey else None,
+                                        rekey=args.rekey, workers=args.workers, kdf_params=kdf_params)
+    if session is None:
+        raise CliError("Не удалось сменить мастер-пароль", EXIT_AUTH)
+    session.lock()
+    emit(out, {"rotated": True, "rekeyed": args.rekey, "kdf": db.get_kdf_params()._asdict()})
+
+
+def cmd_export(db, args, out):
+    # JSON Lines: по одному объекту {"name", "data"} на строку, записи читаются потоком
+    session = unlock(db, args)
+    target = open(args.output, 'w', encoding='utf-8') if args.output else out
+    count = 0
+    try:
+        for name, data in db.iter_secrets(session):
+            emit(target, {"name": name, "data": data})
+            count += 1
+    finally:
+        if args.output:
+            target.close()
+    if args.output:
+        emit(out, {"exported": count, "output": args.output})
+
+
+def cmd_import(db, args, out):
+    if args.password_stdin and not args.input:
+        raise CliError("stdin уже используется для мастер-пароля, укажите --input")
+    session = unlock(db, args)
+    source = open(args.input, 'r', encoding='utf-8') if args.input else sys.stdin
+    saved = 0
+    failed = {}
+
+    def flush(batch):
+        nonlocal saved
+        result = db.save_secrets_bulk(batch, session)
+        if result is None:
+            raise CliError("Не удалось импортировать пакет записей")
+        saved += result[0]
+        failed.update(result[1])
+
+    with source:
+        batch = []
+        for line_number, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                batch.append((record["name"], record["data"]))
+            except (ValueError, KeyError, TypeError) as e:
+                failed[f"line {line_number}"] = f"Некорректная запись: {e}"
+                continue
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    emit(out, {"imported": saved, "failed": failed})
+
+
+def read_archive_password(args, master_password):
+    # По умолчанию архив шифруется мастер-паролем хранилища
+    if args.archive_password_file:
+        with open(args.archive_password_file, 'r', encoding='utf-8') as stream:
+            return stream.readline().rstrip('\r\n')
+    return master_password
+
+
+def cmd_export_archive(db, args, out):
+    master_password = read_password(args)
+    session = db.unlock(master_password)
+    if session is None:
+        raise CliError("Неверный мастер-пароль", EXIT_AUTH)
+    count = db.export_archive(args.output, session, read_archive_password(args, master_password), args.compression)
+    if count is None:
+        raise CliError("Не удалось выгрузить архив")
+    emit(out, {"exported": count, "output": args.output})
+
+
+def cmd_import_archive(db, args, out):
+    master_password = read_password(args)
+    session = db.unlock(master_password)
+    if session is None:
+        raise CliError("Неверный мастер-пароль", EXIT_AUTH)
+    result = db.import_archive(args.input, session, read_archive_password(args, master_password))
+    if result is None:
+        raise CliError("Не удалось загрузить архив")
+    emit(out, {"imported": result[0], "failed": result[1]})
+
+
+def cmd_backup(db, args, out):
+    # Мастер-пароль не нужен: записи копируются в зашифрованном виде
+    snapshot = db.backup(args.dir, args.full, keep_chains=args.keep, max_deltas=args.max_deltas)
+    if snapshot is None:
+        raise CliError("Не удалось создать резервную копию")
+    emit(out, {"snapshot": os.path.basename(snapshot.path), "kind": snapshot.kind, "records": snapshot.records})
+
+
+def cmd_backups(db, args, out):
+    from backup import BackupStore
+    emit(out, [{"snapshot": os.path.basename(snapshot.path), "kind": snapshot.kind, "created": snapshot.created,
+                "records": snapshot.records} for snapshot in BackupStore(args.dir).snapshots()])
+
+
+def cmd_restore(db, args, out):
+    from backup import BackupError, BackupStore
+    try:
+        snapshot = BackupStore(args.dir).restore(args.output, args.snapshot)
+    except BackupError as e:
+        raise CliError(str(e))
+    emit(out, {"restored": os.path.basename(snapshot.path), "output": args.output})
+
+
+def run_sync(func, *args):
+    from sync import SyncError
+    try:
+        return func(*args)
+    except SyncError as e:
+        raise CliError(str(e))
+
+
+def cmd_sync_export(db, args, out):
+    from sync import export_changes
+    session = unlock(db, args)
+    count = run_sync(export_changes, db, session, args.output, args.peer)
+    emit(out, {"replica": db.replica_id, "exported": count, "output": args.output})
+
+
+def cmd_sync_import(db, args, out):
+    from sync import import_changes
+    session = unlock(db, args)
+    applied, skipped = run_sync(import_changes, db, session, args.input)
+    emit(out, {"applied": applied, "skipped": skipped})
+
+
+def cmd_sync(db, args, out):
+    from sync import sync_directory
+    session = unlock(db, args)
+    result = run_sync(sync_directory, db, session, args.dir)
+    emit(out, {"replica": db.replica_id, "exported": result["exported"],
+               "peers": {peer: {"applied": applied, "skipped": skipped}
+                         for peer, (applied, skipped) in result["peers"].items()},
+               "waiting": result["waiting"]})
+
+
+def cmd_replica_reset(db, args, out):
+    from sync import reset_replica
+    unlock(db, args)
+    emit(out, {"replica": run_sync(reset_replica, db)})
+
+
+def cmd_verify(db, args, out):
+    session = unlock(db, args)
+    result = db.verify_integrity(session)
+    if result is None:
+        raise CliError("Не удалось проверить целостность")
+    emit(out, result)
+    if not result["ok"]:
+        raise CliError("Индекс целостности не совпадает с записями" if not result["stale"]
+                       else "Индекс целостности устарел и будет перестроен при следующей разблокировке")
+
+
+def cmd_compare(db, args, out):
+    session = unlock(db, args)
+    result = db.compare_replicas(args.other, session)
+    if result is None:
+        raise CliError("Не удалось сравнить копии")
+    emit(out, result)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py",
+                                     description="Доступ к хранилищу секретов без графического интерфейса")
+    parser.add_argument("--db", default="secrets.db", help="путь к файлу хранилища")
+    password = parser.add_argument_group("мастер-пароль")
+    password.add_argument("--password-fd", type=int, help="прочитать пароль из файлового дескриптора")
+    password.add_argument("--password-file", help="прочитать пароль из первой строки файла")
+    password.add_argument("--password-stdin", action="store_true", help="прочитать пароль из первой строки stdin")
+    password.add_argument("--password-env", default=PASSWORD_ENV,
+                          help=f"переменная окружения с паролем (по умолчанию {PASSWORD_ENV})")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    # Остальные команды работают только с существующим файлом: опечатка в --db не должна
+    # молча создавать пустое хранилище
+    init = commands.add_parser("init", help="создать новое хранилище и задать мастер-пароль")
+    add_kdf_arguments(init)
+    init.set_defaults(handler=cmd_init, create_vault=True)
+
+    get = commands.add_parser("get", help="вывести секрет")
+    get.add_argument("name")
+    get.set_defaults(handler=cmd_get)
+
+    put = commands.add_parser("put", help="сохранить секрет")
+    put.add_argument("name")
+    put.add_argument("--data", help="данные секрета в виде JSON-объекта")
+    put.add_argument("--data-file", help="файл с JSON-объектом ('-' для stdin)")
+    put.set_defaults(handler=cmd_put)
+
+    list_ = commands.add_parser("list", help="список названий")
+    list_.add_argument("--search", help="подстрока для поиска")
+    list_.add_argument("--limit", type=int, help="максимальное число результатов")
+    list_.add_argument("--type", choices=sorted(SECRET_TYPES), help="только секреты этого типа")
+    list_.add_argument("--tag", help="только секреты с этим тегом")
+    list_.add_argument("--host", help="только секреты для этого хоста")
+    list_.add_argument("--folder", help="только секреты из этой папки и вложенных")
+    list_.set_defaults(handler=cmd_list)
+
+    delete = commands.add_parser("delete", help="удалить секрет")
+    delete.add_argument("name")
+    delete.set_defaults(handler=cmd_delete)
+
+    passwd = commands.add_parser("passwd", help="сменить мастер-пароль")
+    passwd.add_argument("--new-password-file", help="прочитать новый пароль из первой строки файла "
+                                                    f"(иначе {NEW_PASSWORD_ENV} или интерактивный ввод)")
+    passwd.add_argument("--rekey", action="store_true",
+                        help="заменить ключ данных и перешифровать все записи (копии для синхронизации "
+                             "со старым ключом после этого нужно получить заново)")
+    passwd.add_argument("--workers", type=int, help="число процессов для перешифровки")
+    add_kdf_arguments(passwd)
+    passwd.set_defaults(handler=cmd_passwd)
+
+    export = commands.add_parser("export", help="выгрузить все секреты в JSON Lines")
+    export.add_argument("--output", help="файл для выгрузки (по умолчанию stdout)")
+    export.set_defaults(handler=cmd_export)
+
+    import_ = commands.add_parser("import", help="загрузить секреты из JSON Lines")
+    import_.add_argument("--input", help="файл для загрузки (по умолчанию stdin)")
+    import_.set_defaults(handler=cmd_import)
+    export_archive = commands.add_parser("export-archive", help="выгрузить все секреты в зашифрованный архив")
+    export_archive.add_argument("--output", required=True, help="файл архива")
+    export_archive.add_argument("--compression", choices=["zlib", "zstd"],
+                                help="сжатие (по умолчанию zstd, если установлен zstandard)")
+    export_archive.add_argument("--archive-password-file",
+                                help="пароль архива из первой строки файла (по умолчанию мастер-пароль)")
+    export_archive.set_defaults(handler=cmd_export_archive)
+
+    import_archive = commands.add_parser("import-archive", help="загрузить секреты из зашифрованного архива")
+    import_archive.add_argument("--input", required=True, help="файл архива")
+    import_archive.add_argument("--archive-password-file",
+                                help="пароль архива из первой строки файла (по умолчанию мастер-пароль)")
+    import_archive.set_defaults(handler=cmd_import_archive)
+
+    backup = commands.add_parser("backup", help="снимок хранилища в каталог резервных копий")
+    backup.add_argument("--dir", required=True, help="каталог резервных копий")
+    backup.add_argument("--full", action="store_true", help="полный снимок вместо дельты")
+    backup.add_argument("--keep", type=int, help="сколько последних цепочек снимков хранить")
+    backup.add_argument("--max-deltas", type=int, help="число дельт, после которого делается полный снимок")
+    backup.set_defaults(handler=cmd_backup)
+
+    backups = commands.add_parser("backups", help="список снимков в каталоге резервных копий")
+    backups.add_argument("--dir", required=True, help="каталог резервных копий")
+    backups.set_defaults(handler=cmd_backups, needs_vault=False)
+
+    restore = commands.add_parser("restore", help="восстановить хранилище из резервных копий в новый файл")
+    restore.add_argument("--dir", required=True, help="каталог резервных копий")
+    restore.add_argument("--output", required=True, help="новый файл хранилища")
+    restore.add_argument("--snapshot", help="имя снимка, до которого восстановить (по умолчанию последний)")
+    restore.set_defaults(handler=cmd_restore, needs_vault=False)
+
+    sync_export = commands.add_parser("sync-export", help="выгрузить журнал изменений для другой копии")
+    sync_export.add_argument("--output", required=True, help="файл изменений")
+    sync_export.add_argument("--peer", help="копия-получатель: выгрузить только то, что она еще не подтвердила")
+    sync_export.set_defaults(handler=cmd_sync_export)
+
+    sync_import = commands.add_parser("sync-import", help="применить файл изменений другой копии")
+    sync_import.add_argument("--input", required=True, help="файл изменений")
+    sync_import.set_defaults(handler=cmd_sync_import)
+
+    sync = commands.add_parser("sync", help="синхронизировать копии через общий каталог")
+    sync.add_argument("--dir", required=True, help="общий каталог файлов изменений")
+    sync.set_defaults(handler=cmd_sync)
+
+    replica_reset = commands.add_parser("replica-reset",
+                                        help="выдать скопированному файлу хранилища собственный идентификатор копии")
+    replica_reset.set_defaults(handler=cmd_replica_reset)
+
+    verify = commands.add_parser("verify", help="сверить записи с индексом целостности")
+    verify.set_defaults(handler=cmd_verify)
+
+    compare = commands.add_parser("compare", help="найти расхождения с другой копией по индексам целостности")
+    compare.add_argument("--other", required=True, help="файл другой копии хранилища")
+    compare.set_defaults(handler=cmd_compare)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    out = sys.stdout
+    # Database пишет диагностику через print: уводим ее в stderr, чтобы stdout оставался чистым JSON
+    with redirect_stdout(sys.stderr):
+        try:
+            if not getattr(args, "needs_vault", True):
+                args.handler(None, args, out)
+            elif not getattr(args, "create_vault", False) and not os.path.exists(args.db):
+                raise CliError(f"Хранилище {args.db} не найдено (новое создается командой init)")
+            else:
+                with Database(args.db) as db:
+                    args.handler(db, args, out)
+        except CliError as e:
+            emit(sys.stderr, {"error": str(e)})
+            return e.exit_code
+        except (OSError, ValueError) as e:
+            emit(sys.stderr, {"error": str(e)})
+            return EXIT_ERROR
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
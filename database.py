@@ -1,186 +1,1063 @@
 
 import sqlite3
 import json
-from datetime import datetime
+from datetime import datetime, timezone
 import base64
 import os
 import hashlib
+import hmac
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from secret_types import extract_metadata
+import merkle
+
+
+DEFAULT_IDLE_TIMEOUT = 300
+STATEMENT_CACHE_SIZE = 256
+BUSY_TIMEOUT_MS = 5000
+BULK_WORKERS = min(8, os.cpu_count() or 1)
+ITER_CHUNK_SIZE = 500
+REKEY_CHUNK_SIZE = 500
+REKEY_WORKERS = os.cpu_count() or 1
+TRIGRAM_MIN_LENGTH = 3
+RECORD_CACHE_SIZE = 256
+RECORD_CACHE_TTL = 120
+KDF_PBKDF2 = 'pbkdf2_sha256'
+KDF_SCRYPT = 'scrypt'
+DEFAULT_KDF_TARGET_SECONDS = 0.5
+SCRYPT_MAX_LOG_N = 20
+
+# Для scrypt: iterations = N (стоимость), memory_cost = r (размер блока), parallelism = p
+KdfParams = namedtuple('KdfParams', ['kdf', 'iterations', 'memory_cost', 'parallelism'])
+DEFAULT_KDF_PARAMS = KdfParams(KDF_PBKDF2, 100000, None, None)
+RECORD_FORMAT_SHAKE_HMAC = 2
+NONCE_SIZE = 16
+DATA_KEY_SIZE = 32
+
+
+def _xor_bytes(data: bytes, pad: bytes) -> bytes:
+    # XOR целыми буферами через длинную арифметику вместо цикла по байтам
+    return (int.from_bytes(data, 'little') ^ int.from_bytes(pad, 'little')).to_bytes(len(data), 'little')
+
+
+class ShakeHmacCipher:
+    # Потоковый шифр на SHAKE-256 + HMAC-SHA256 (encrypt-then-MAC), только стандартная библиотека.
+    # Номер формата 1 не используется: им был удаленный неаутентифицированный XOR-формат.
+    format_version = RECORD_FORMAT_SHAKE_HMAC
+    tag_size = 16
+
+    def encrypt(self, data: bytes, key: bytes) -> bytes:
+        nonce = os.urandom(NONCE_SIZE)
+        enc_key, mac_key = self._subkeys(key)
+        header = bytes([self.format_version]) + nonce
+        ciphertext = _xor_bytes(data, hashlib.shake_256(enc_key + nonce).digest(len(data)))
+        tag = hmac.new(mac_key, header + ciphertext, hashlib.sha256).digest()[:self.tag_size]
+        return header + ciphertext + tag
+
+    def decrypt(self, encrypted_data: bytes, key: bytes) -> bytes:
+        if len(encrypted_data) < 1 + NONCE_SIZE + self.tag_size:
+            raise ValueError("Запись повреждена")
+        enc_key, mac_key = self._subkeys(key)
+        header = encrypted_data[:1 + NONCE_SIZE]
+        ciphertext = encrypted_data[1 + NONCE_SIZE:-self.tag_size]
+        tag = encrypted_data[-self.tag_size:]
+        expected = hmac.new(mac_key, header + ciphertext, hashlib.sha256).digest()[:self.tag_size]
+        if not hmac.compare_digest(tag, expected):
+            raise ValueError("Нарушена целостность записи")
+        return _xor_bytes(ciphertext, hashlib.shake_256(enc_key + header[1:]).digest(len(ciphertext)))
+
+    def _subkeys(self, key: bytes) -> tuple:
+        return (hmac.new(key, b'enc', hashlib.sha256).digest(),
+                hmac.new(key, b'mac', hashlib.sha256).digest())
+
+
+# Новый формат записей добавляется сюда со своим номером: get_cipher выбирает шифр по первому байту
+CIPHERS = {cipher.format_version: cipher for cipher in (ShakeHmacCipher(),)}
+DEFAULT_CIPHER = CIPHERS[RECORD_FORMAT_SHAKE_HMAC]
+
+
+def derive_kdf(password: bytes, salt: bytes, params: KdfParams, length: int = 32) -> bytes:
+    if params.kdf == KDF_PBKDF2:
+        return hashlib.pbkdf2_hmac('sha256', password, salt, params.iterations, length)
+    if params.kdf == KDF_SCRYPT:
+        n, r, p = params.iterations, params.memory_cost or 8, params.parallelism or 1
+        return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p,
+                              maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=length)
+    raise ValueError(f"Неизвестная функция формирования ключа: {params.kdf}")
+
+
+def calibrate_kdf(kdf: str = KDF_PBKDF2, target_seconds: float = DEFAULT_KDF_TARGET_SECONDS) -> KdfParams:
+    # Подбирает стоимость KDF так, чтобы одно вычисление занимало около target_seconds на этой машине
+    salt = os.urandom(16)
+    if kdf == KDF_PBKDF2:
+        probe = KdfParams(KDF_PBKDF2, 20000, None, None)
+        start = time.perf_counter()
+        derive_kdf(b'calibration', salt, probe)
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        iterations = int(probe.iterations * target_seconds / elapsed)
+        return KdfParams(KDF_PBKDF2, max(DEFAULT_KDF_PARAMS.iterations, iterations), None, None)
+    if kdf == KDF_SCRYPT:
+        # Время scrypt линейно по N, а N должно быть степенью двойки: берем ближайшую к цели
+        probe = KdfParams(KDF_SCRYPT, 2 ** 14, 8, 1)
+        start = time.perf_counter()
+        derive_kdf(b'calibration', salt, probe)
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        exponent = 14 + round(math.log2(max(target_seconds / elapsed, 1)))
+        return probe._replace(iterations=2 ** min(exponent, SCRYPT_MAX_LOG_N))
+    raise ValueError(f"Неизвестная функция формирования ключа: {kdf}")
+
+
+def utc_now() -> str:
+    # Время изменения хранится в UTC с явным смещением: по нему копии в разных часовых поясах
+    # решают, чье изменение позже
+    return datetime.now(timezone.utc).isoformat(sep=' ')
+
+
+def parse_timestamp(value) -> datetime:
+    # Значения без смещения записаны прежними версиями по местному времени
+    moment = datetime.fromisoformat(str(value))
+    if moment.tzinfo is None:
+        moment = moment.astimezone()
+    return moment.astimezone(timezone.utc)
+
+
+def _escape_like(term: str) -> str:
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def get_cipher(format_version: int):
+    cipher = CIPHERS.get(format_version)
+    if cipher is None:
+        raise ValueError(f"Неизвестный формат записи: {format_version}")
+    return cipher
+
+
+def _reencrypt_records(rows, old_key: bytes, new_key: bytes) -> list:
+    # Функция уровня модуля, чтобы ее можно было передать в дочерний процесс
+    return [(DEFAULT_CIPHER.encrypt(get_cipher(encrypted_data[0]).decrypt(encrypted_data, old_key), new_key), record_id)
+            for record_id, encrypted_data in rows]
+
+
+class VaultSession:
+    def __init__(self, data_key: bytes, idle_timeout: float = DEFAULT_IDLE_TIMEOUT, key_generation: int = 0):
+        self.idle_timeout = idle_timeout
+        # Поколение ключа данных, под которым открыта сессия (vault_keys.key_generation)
+        self.key_generation = key_generation
+        # Ключ данных хранилища держим в bytearray, чтобы затереть его при блокировке
+        self._data_key = bytearray(data_key)
+        self._lock_callbacks = []
+        self._last_used = time.monotonic()
+        self._locked = False
+
+    @property
+    def is_unlocked(self) -> bool:
+        if self._locked:
+            return False
+        if self.idle_timeout and time.monotonic() - self._last_used > self.idle_timeout:
+            self.lock()
+            return False
+        return True
+
+    def touch(self):
+        self._last_used = time.monotonic()
+
+    def lock(self):
+        self._data_key[:] = bytes(len(self._data_key))
+        self._locked = True
+        for callback in self._lock_callbacks:
+            callback()
+        self._lock_callbacks.clear()
+
+    def on_lock(self, callback):
+        self._lock_callbacks.append(callback)
+
+    @property
+    def data_key(self) -> bytes:
+        if not self.is_unlocked:
+            raise PermissionError("Сессия хранилища заблокирована")
+        self.touch()
+        return bytes(self._data_key)
+
+
+class RecordCache:
+    # LRU расшифрованных записей с ограничением по размеру и TTL. Ключ — имя и updated_at,
+    # поэтому измененная запись не отдается из кэша. Открытый текст хранится в bytearray
+    # и затирается нулями при вытеснении, чтобы не оставаться в памяти.
+    def __init__(self, max_entries=RECORD_CACHE_SIZE, ttl=RECORD_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Сроки в порядке добавления: TTL общий, поэтому истекшие записи всегда в начале очереди
+        self._expiry = deque()
+        self._lock = threading.Lock()
+
+    def get(self, name, updated_at):
+        with self._lock:
+            self._purge_expired()
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            cached_updated_at, expires_at, plaintext = entry
+            if cached_updated_at != updated_at or expires_at < time.monotonic():
+                self._evict(name)
+                return None
+            self._entries.move_to_end(name)
+            return json.loads(bytes(plaintext))
+
+    def put(self, name, updated_at, plaintext: bytes):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._purge_expired()
+            if name in self._entries:
+                self._evict(name)
+            expires_at = time.monotonic() + self.ttl
+            self._entries[name] = (updated_at, expires_at, bytearray(plaintext))
+            self._expiry.append((expires_at, name))
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+    def invalidate(self, names):
+        with self._lock:
+            for name in names:
+                if name in self._entries:
+                    self._evict(name)
+
+    def purge_expired(self):
+        # Вызывается и по таймеру: открытый текст не должен ждать в памяти следующего обращения к кэшу
+        with self._lock:
+            self._purge_expired()
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        while self._expiry and self._expiry[0][0] < now:
+            expires_at, name = self._expiry.popleft()
+            entry = self._entries.get(name)
+            # Запись могла быть перезаписана позже, тогда у нее другой срок
+            if entry is not None and entry[1] == expires_at:
+                self._evict(name)
+
+    def clear(self):
+        with self._lock:
+            for name in list(self._entries):
+                self._evict(name)
+            self._expiry.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, name):
+        _, _, plaintext = self._entries.pop(name)
+        plaintext[:] = bytes(len(plaintext))
 
 
 class Database:
-    def __init__(self, db_path='secrets.db'):
+    def __init__(self, db_path='secrets.db', cache_ttl=RECORD_CACHE_TTL, cache_size=RECORD_CACHE_SIZE):
         self.db_path = db_path
+        # Одно долгоживущее соединение на экземпляр; доступ из разных потоков сериализуется блокировкой
+        self._lock = threading.RLock()
+        self._conn = self._connect()
+        self._record_cache = RecordCache(cache_size, cache_ttl)
+        # Ключ индекса целостности известен, пока открыта сессия
+        self._merkle_key = None
+        self._merkle_session = None
         self.init_database()
 
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        return conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def _transaction(self, immediate=False):
+        with self._lock:
+            with self._conn:
+                if immediate:
+                    # Блокировка записи берется сразу: проверки и чтения перед записью (поколение
+                    # ключа, прежние версии записей для индекса целостности и журнала) видят то же
+                    # состояние, что и сама запись, а DDL попадает в ту же транзакцию
+                    self._conn.execute('BEGIN IMMEDIATE')
+                yield self._conn.cursor()
+
+    @contextmanager
+    def _separate_transaction(self):
+        # Долгая запись на отдельном соединении не держит self._lock: в режиме WAL чтения основного
+        # соединения идут параллельно и видят прежний снимок до фиксации
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                yield conn.cursor()
+        finally:
+            conn.close()
+
+    def _fetchone(self, query, params=()):
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()
+
+    def _fetchall(self, query, params=()):
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
     def init_database(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS secrets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL UNIQUE,
-                encrypted_data BLOB NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS master_password (
-                id INTEGER PRIMARY KEY CHECK (id = 1),
-                password_hash TEXT NOT NULL,
-                salt BLOB NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        # Схема ведется миграциями по PRAGMA user_version: для актуального файла это одно чтение
+        # без DDL. Импорт отложен, потому что migrations сам зависит от этого модуля.
+        from migrations import migrate
+        migrate(self)
+        self._load_schema_features()
+
+    def _load_schema_features(self):
+        # Возможности, которые зависят от примененных миграций; перечитываются после разблокировки
+        self._fts_enabled = self._fetchone(
+            "SELECT 1 FROM sqlite_master WHERE name = 'secrets_fts'") is not None
+        has_replica = self._fetchone("SELECT 1 FROM sqlite_master WHERE name = 'replica'") is not None
+        self.replica_id = self._fetchone('SELECT replica_id FROM replica WHERE id = 1')[0] if has_replica else None
+        self._merkle_enabled = self._fetchone(
+            "SELECT 1 FROM sqlite_master WHERE name = 'merkle_nodes'") is not None
+
+    def schema_version(self) -> int:
+        return self._fetchone('PRAGMA user_version')[0]
 
     def is_master_password_set(self) -> bool:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT 1 FROM master_password WHERE id = 1')
-        result = cursor.fetchone()
-        conn.close()
-        return result is not None
+        return self._fetchone('SELECT 1 FROM master_password WHERE id = 1') is not None
 
-    def set_master_password(self, master_password: str) -> bool:
+    def set_master_password(self, master_password: str, kdf_params: KdfParams = None) -> bool:
         try:
             if self.is_master_password_set():
                 return False
-            password_hash, salt = self._hash_password(master_password)
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO master_password (id, password_hash, salt)
-                VALUES (1, ?, ?)
-            ''', (password_hash, salt))
-            conn.commit()
-            conn.close()
+            kdf_params = kdf_params or DEFAULT_KDF_PARAMS
+            password_hash, salt = self._hash_password(master_password, params=kdf_params)
+            with self._transaction(immediate=True) as cursor:
+                cursor.execute('''
+                    INSERT INTO master_password (id, password_hash, salt, kdf, iterations, memory_cost, parallelism)
+                    VALUES (1, ?, ?, ?, ?, ?, ?)
+                ''', (password_hash, salt, *kdf_params))
+                self._create_data_key(cursor, master_password, kdf_params)
             return True
         except Exception as e:
             print(f"Ошибка при установке мастер-пароля: {e}")
             return False
 
+    def get_kdf_params(self) -> KdfParams:
+        result = self._fetchone(
+            'SELECT kdf, iterations, memory_cost, parallelism FROM master_password WHERE id = 1')
+        return KdfParams(*result) if result else DEFAULT_KDF_PARAMS
+
     def verify_master_password(self, master_password: str) -> bool:
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT password_hash, salt FROM master_password WHERE id = 1')
-            result = cursor.fetchone()
-            conn.close()
-            if result:
-                stored_hash, salt = result
-                return self._verify_password(master_password, stored_hash, salt)
-            return False
+            result = self._fetchone('''
+                SELECT password_hash, salt, kdf, iterations, memory_cost, parallelism
+                FROM master_password WHERE id = 1
+            ''')
+            if not result:
+                return False
+            stored_hash, salt, *params = result
+            return self._verify_password(master_password, stored_hash, salt, KdfParams(*params))
         except Exception as e:
             print(f"Ошибка при проверке мастер-пароля: {e}")
             return False
 
+    def unlock(self, master_password: str, idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        if not master_password:
+            return None
+        # Ключ данных обернут с проверкой целостности, поэтому успешное снятие обертки и есть проверка
+        # пароля: KDF выполняется один раз. Хеш пароля сверяется, только пока ключа данных еще нет
+        # (хранилище старого формата до миграции)
+        try:
+            data_key = self._unwrap_stored_key(master_password)
+        except ValueError:
+            return None
+        except Exception as e:
+            print(f"Ошибка при проверке мастер-пароля: {e}")
+            return None
+        if data_key is None and not self.verify_master_password(master_password):
+            return None
+        try:
+            from migrations import migrate
+            # Шаги миграции, которым нужен ключ, выполняются при первой разблокировке
+            migrate(self, master_password)
+            self._load_schema_features()
+            if data_key is None:
+                data_key = self._load_data_key(master_password)
+            self._ensure_merkle_index(data_key)
+        except Exception as e:
+            print(f"Ошибка при открытии хранилища: {e}")
+            return None
+        return self._open_session(data_key, idle_timeout)
+
+    def purge_expired_records(self):
+        self._record_cache.purge_expired()
+
+    def _open_session(self, data_key: bytes, idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        session = VaultSession(data_key, idle_timeout, self._key_generation())
+        # Расшифрованные записи не должны пережить блокировку сессии
+        session.on_lock(self._record_cache.clear)
+        self._merkle_key = merkle.merkle_key(data_key)
+        self._merkle_session = session
+        session.on_lock(lambda: self._forget_merkle_key(session))
+        return session
+
+    def _forget_merkle_key(self, session):
+        # Ключ индекса принадлежит последней открытой сессии: блокировка более старой
+        # (например, после смены пароля) его не сбрасывает
+        if self._merkle_session is session:
+            self._merkle_key = None
+            self._merkle_session = None
+
+    def _ensure_merkle_index(self, data_key: bytes):
+        # Индекс перестраивается, если его еще нет, он построен под другой ключ данных
+        # или помечен устаревшим после изменения без открытой сессии
+        if not self._merkle_enabled:
+            return
+        key = merkle.merkle_key(data_key)
+        with self._lock:
+            if merkle.is_current(self._conn.cursor(), key):
+                return
+            with self._transaction(immediate=True) as cursor:
+                if not merkle.is_current(cursor, key):
+                    merkle.rebuild(cursor, key)
+
+    def _update_merkle(self, cursor, removed, added):
+        if not self._merkle_enabled:
+            return
+        if self._merkle_key is None:
+            merkle.invalidate(cursor)
+            return
+        merkle.update(cursor, self._merkle_key, removed, added)
+
+    def rotate_master_password(self, old_password: str, new_password: str, progress=None, rekey=False,
+                               workers=None, kdf_params: KdfParams = None):
+        # Записи зашифрованы ключом данных, поэтому смена пароля — это новый хэш и перешифровка
+        # одного ключа, O(1) по числу записей. rekey=True дополнительно заменяет сам ключ данных
+        # (если старый мог утечь) и перешифровывает все записи в пуле процессов.
+        # Все изменения фиксируются одной транзакцией; возвращается сессия под новым паролем.
+        # После rekey другие открытые сессии держат старый ключ и отклоняются по поколению ключа,
+        # а sync.key_id меняется: копии со старым ключом больше не синхронизируются с этой,
+        # их нужно заново получить копированием файла хранилища.
+        try:
+            if not new_password:
+                return None
+            session = self.unlock(old_password)
+            if session is None:
+                return None
+            old_key = bytes(session.data_key)
+            session.lock()
+
+            kdf_params = kdf_params or self.get_kdf_params()
+            new_key = os.urandom(DATA_KEY_SIZE) if rekey else old_key
+            password_hash, salt = self._hash_password(new_password, params=kdf_params)
+            kek_salt, wrapped_key = self._wrap_data_key(new_key, new_password, kdf_params)
+
+            # Перешифровка в пуле процессов идет долго: под self._lock она остановила бы счетчик
+            # и страницы списка в окне, поэтому rekey пишет через отдельное соединение
+            transaction = self._separate_transaction() if rekey else self._transaction(immediate=True)
+            with transaction as cursor:
+                if rekey:
+                    self._rekey_records(cursor, old_key, new_key, progress, workers or REKEY_WORKERS)
+                    if self.replica_id is not None:
+                        # Шифртекст в журнале — последняя версия записи: под старым ключом он не остается
+                        cursor.execute('''
+                            UPDATE change_log SET encrypted_data =
+                                (SELECT s.encrypted_data FROM secrets s WHERE s.name = change_log.name)
+                            WHERE encrypted_data IS NOT NULL
+                        ''')
+                    if self._merkle_enabled:
+                        merkle.rebuild(cursor, merkle.merkle_key(new_key))
+                cursor.execute('''
+                    UPDATE master_password
+                    SET password_hash = ?, salt = ?, kdf = ?, iterations = ?, memory_cost = ?, parallelism = ?
+                    WHERE id = 1
+                ''', (password_hash, salt, *kdf_params))
+                cursor.execute('''
+                    UPDATE vault_keys SET kek_salt = ?, wrapped_key = ?, key_generation = key_generation + ?
+                    WHERE id = 1
+                ''', (kek_salt, wrapped_key, int(rekey)))
+
+            return self._open_session(new_key)
+        except Exception as e:
+            print(f"Ошибка при смене мастер-пароля: {e}")
+            return None
+
+    def _rekey_records(self, cursor, old_key: bytes, new_key: bytes, progress, workers):
+        cursor.execute('SELECT COUNT(*) FROM secrets')
+        total = cursor.fetchone()[0]
+        done = 0
+        if progress:
+            progress(done, total)
+        # Для небольших хранилищ запуск процессов дороже самой перешифровки
+        executor = None
+        if workers > 1 and total > REKEY_CHUNK_SIZE:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # fork в процессе с потоками (Tk, фоновые задачи, агент) копирует чужие захваченные блокировки
+            # и открытое соединение SQLite; spawn запускает чистый интерпретатор
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+        try:
+            reader = cursor.connection.cursor()
+            last_id = 0
+            while True:
+                # Читаем по порции на процесс, ключ id позволяет обновлять уже прочитанные строки
+                reader.execute('SELECT id, encrypted_data FROM secrets WHERE id > ? ORDER BY id LIMIT ?',
+                               (last_id, REKEY_CHUNK_SIZE * workers))
+                rows = reader.fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                chunks = [rows[i:i + REKEY_CHUNK_SIZE] for i in range(0, len(rows), REKEY_CHUNK_SIZE)]
+                if executor is not None:
+                    results = executor.map(_reencrypt_records, chunks,
+                                           itertools.repeat(old_key), itertools.repeat(new_key))
+                else:
+                    results = (_reencrypt_records(chunk, old_key, new_key) for chunk in chunks)
+                for updated in results:
+                    cursor.executemany('UPDATE secrets SET encrypted_data = ? WHERE id = ?', updated)
+                    done += len(updated)
+                    if progress:
+                        progress(done, total)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _load_data_key(self, master_password: str) -> bytes:
+        data_key = self._unwrap_stored_key(master_password)
+        if data_key is not None:
+            return data_key
+        with self._transaction(immediate=True) as cursor:
+            return self._create_data_key(cursor, master_password)
+
+    def _unwrap_stored_key(self, master_password: str):
+        # None — ключа данных еще нет; при неверном пароле снятие обертки бросает ValueError
+        result = self._fetchone('SELECT kek_salt, wrapped_key FROM vault_keys WHERE id = 1')
+        if not result:
+            return None
+        kek_salt, wrapped_key = result
+        return self._unwrap_data_key(wrapped_key, kek_salt, master_password, self.get_kdf_params())
+
+    def _create_data_key(self, cursor, master_password: str, kdf_params: KdfParams = None) -> bytes:
+        data_key = os.urandom(DATA_KEY_SIZE)
+        kek_salt, wrapped_key = self._wrap_data_key(data_key, master_password, kdf_params or self.get_kdf_params())
+        cursor.execute('''
+            INSERT INTO vault_keys (id, kek_salt, wrapped_key)
+            VALUES (1, ?, ?)
+        ''', (kek_salt, wrapped_key))
+        return data_key
+
+    def _key_generation(self, cursor=None) -> int:
+        query = 'SELECT key_generation FROM vault_keys WHERE id = 1'
+        if cursor is None:
+            row = self._fetchone(query)
+        else:
+            cursor.execute(query)
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def _check_session_key(self, session: VaultSession, cursor=None):
+        # Сессия, открытая до замены ключа данных, зашифровала бы записи ключом, которого больше нет
+        if session.key_generation != self._key_generation(cursor):
+            session.lock()
+            raise PermissionError("Ключ данных хранилища заменен: разблокируйте хранилище заново")
+
+    def _resolve_session(self, credential):
+        if isinstance(credential, VaultSession):
+            if not credential.is_unlocked:
+                return None
+            try:
+                self._check_session_key(credential)
+            except PermissionError as e:
+                print(f"Ошибка сессии: {e}")
+                return None
+            return credential
+        return self.unlock(credential)
+
     def save_secret(self, name, secret_data, master_password):
         try:
-            if not self.verify_master_password(master_password):
+            session = self._resolve_session(master_password)
+            if session is None:
                 return False
             json_data = json.dumps(secret_data)
-            encrypted_data = self._encrypt_data(json_data, master_password)
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO secrets (name, encrypted_data, updated_at)
-                VALUES (?, ?, ?)
-            ''', (name, encrypted_data, datetime.now()))
-            conn.commit()
-            conn.close()
+            encrypted_data = self._encrypt_data(json_data, session)
+            with self._transaction(immediate=True) as cursor:
+                self._check_session_key(session, cursor)
+                self._upsert_records(cursor, [self._record_row(name, secret_data, encrypted_data)])
             return True
         except Exception as e:
             print(f"Ошибка при сохранении: {e}")
             return False
 
+    def save_secrets_bulk(self, items, master_password, workers=None):
+        # Пароль проверяется один раз, записи шифруются параллельно и вставляются одной транзакцией.
+        # Возвращает (число сохраненных, {имя: ошибка}) или None, если пароль неверен.
+        session = self._resolve_session(master_password)
+        if session is None:
+            return None
+        data_key = session.data_key
+
+        def encrypt_item(indexed_item):
+            index, item = indexed_item
+            # Имя для отчета об ошибке берется до распаковки: кривой элемент не должен срывать весь пакет
+            name = f"#{index}: {item!r}"
+            if isinstance(item, (tuple, list)) and item and isinstance(item[0], str) and item[0]:
+                name = item[0]
+            try:
+                secret_name, secret_data = item
+                if not isinstance(secret_name, str):
+                    raise ValueError("Название секрета должно быть строкой")
+                if not secret_name:
+                    raise ValueError("Пустое название секрета")
+                encrypted_data = self._encrypt_with_key(json.dumps(secret_data).encode(), data_key)
+                return secret_name, self._record_row(secret_name, secret_data, encrypted_data), None
+            except Exception as e:
+                return name, None, str(e)
+
+        # Пул нужен только массовому сохранению, поэтому не замедляет импорт модуля при запуске
+        from concurrent.futures import ThreadPoolExecutor
+
+        rows = []
+        failures = {}
+        with ThreadPoolExecutor(max_workers=workers or BULK_WORKERS) as executor:
+            for name, row, error in executor.map(encrypt_item, enumerate(items)):
+                if error is None:
+                    rows.append(row)
+                else:
+                    failures[name] = error
+        try:
+            with self._transaction(immediate=True) as cursor:
+                self._check_session_key(session, cursor)
+                saved = self._upsert_records(cursor, rows)
+        except Exception as e:
+            print(f"Ошибка при пакетном сохранении: {e}")
+            return None
+        return saved, failures
+
+    def _record_row(self, name, secret_data, encrypted_data):
+        metadata = extract_metadata(secret_data)
+        return name, encrypted_data, utc_now(), metadata.type, metadata.host, metadata.folder, metadata.tags
+
+    def _upsert_records(self, cursor, rows, origin=None):
+        # Строки: (name, encrypted_data, updated_at, type, host, folder, tags); origin — копия,
+        # на которой сделано изменение (для изменений, полученных синхронизацией).
+        # Повтор имени в пакете: остается последняя строка, иначе лист дерева Меркла учелся бы
+        # дважды, а журнал получил бы две вставки. Возвращает число сохраненных записей.
+        rows = list({row[0]: row for row in rows}.values())
+        self._record_cache.invalidate(row[0] for row in rows)
+        cursor.execute('''
+            SELECT name, encrypted_data, updated_at FROM secrets WHERE name IN (SELECT value FROM json_each(?))
+        ''', (json.dumps([row[0] for row in rows]),))
+        previous = cursor.fetchall()
+        existing = {row[0] for row in previous}
+        # UPSERT вместо INSERT OR REPLACE: сохраняет id и created_at, и триггеры индекса срабатывают корректно
+        cursor.executemany('''
+            INSERT INTO secrets (name, encrypted_data, updated_at, type, host, folder)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET
+                encrypted_data = excluded.encrypted_data,
+                updated_at = excluded.updated_at,
+                type = excluded.type,
+                host = excluded.host,
+                folder = excluded.folder
+        ''', (row[:6] for row in rows))
+        self._set_tags(cursor, [(row[0], row[6]) for row in rows])
+        self._update_merkle(cursor, previous, [row[:3] for row in rows])
+        self._log_changes(cursor, [('update' if row[0] in existing else 'insert', *row) for row in rows], origin)
+        return len(rows)
+
+    def _log_changes(self, cursor, entries, origin=None):
+        # entries: (op, name, encrypted_data, updated_at, type, host, folder, tags).
+        # В журнале только последнее изменение каждой записи (имя уникально): прежние версии
+        # шифртекста не копятся, а удаление остается отметкой без данных. Новая строка получает
+        # следующий seq, поэтому выгрузка «после seq» по-прежнему видит все изменения.
+        if self.replica_id is None:
+            return
+        cursor.executemany('''
+            INSERT OR REPLACE INTO change_log (op, name, encrypted_data, updated_at, origin, type, host, folder, tags)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', ((op, name, encrypted_data, str(updated_at), origin or self.replica_id, secret_type, host, folder,
+               None if tags is None else json.dumps(tags, ensure_ascii=False))
+              for op, name, encrypted_data, updated_at, secret_type, host, folder, tags in entries))
+
+    def _set_tags(self, cursor, items):
+        # items: [(имя секрета, [теги])]; прежние теги записей заменяются целиком
+        cursor.executemany('''
+            DELETE FROM secret_tags WHERE secret_id = (SELECT id FROM secrets WHERE name = ?)
+        ''', ((name,) for name, _ in items))
+        pairs = [(name, tag) for name, tags in items for tag in tags]
+        if not pairs:
+            return
+        cursor.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)', ((tag,) for _, tag in pairs))
+        cursor.executemany('''
+            INSERT OR IGNORE INTO secret_tags (secret_id, tag_id)
+            SELECT s.id, t.id FROM secrets s, tags t WHERE s.name = ? AND t.name = ?
+        ''', pairs)
+
     def get_secret(self, name, master_password):
         try:
-            if not self.verify_master_password(master_password):
+            session = self._resolve_session(master_password)
+            if session is None:
                 return None
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT encrypted_data FROM secrets WHERE name = ?', (name,))
-            result = cursor.fetchone()
-            conn.close()
+            result = self._fetchone('SELECT updated_at FROM secrets WHERE name = ?', (name,))
+            if not result:
+                return None
+            cached = self._record_cache.get(name, result[0])
+            if cached is not None:
+                session.touch()
+                return cached
+
+            result = self._fetchone('SELECT encrypted_data, updated_at FROM secrets WHERE name = ?', (name,))
             if result:
-                encrypted_data = result[0]
-                decrypted_json = self._decrypt_data(encrypted_data, master_password)
+                encrypted_data, updated_at = result
+                decrypted_json = self._decrypt_data(encrypted_data, session)
+                self._record_cache.put(name, updated_at, decrypted_json.encode())
                 return json.loads(decrypted_json)
             return None
         except Exception as e:
             print(f"Ошибка при расшифровке: {e}")
             return None
 
-    def search_secrets(self, search_term=''):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def export_archive(self, target, session, archive_password: str, compression=None):
+        # Потоковая выгрузка в зашифрованный архив (формат в archive.py): записи читаются порциями,
+        # поэтому память не зависит от размера хранилища. target — путь или двоичный поток.
+        # Файл пишется во временный и заменяется целиком, чтобы прерванная выгрузка не оставила обрезок.
+        from archive import ArchiveWriter, DEFAULT_COMPRESSION
+        temp_path = f'{target}.tmp' if isinstance(target, str) else None
+        try:
+            stream = open(temp_path, 'wb') if temp_path else target
+            try:
+                writer = ArchiveWriter(stream, archive_password, self.get_kdf_params(),
+                                       compression or DEFAULT_COMPRESSION)
+                for name, secret_data in self.iter_secrets(session):
+                    writer.add(name, secret_data)
+                writer.close()
+            finally:
+                if temp_path:
+                    stream.close()
+            if temp_path:
+                os.replace(temp_path, target)
+            return writer.records
+        except Exception as e:
+            print(f"Ошибка при выгрузке архива: {e}")
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+
+    def import_archive(self, source, session, archive_password: str):
+        # Каждая порция архива проверяется и сохраняется своей транзакцией сразу после чтения.
+        # Возвращает (число сохраненных, {имя: ошибка}) или None; порции до ошибки остаются сохраненными.
+        from archive import read_archive
+        saved = 0
+        failures = {}
+        try:
+            stream = open(source, 'rb') if isinstance(source, str) else source
+            try:
+                for batch in read_archive(stream, archive_password):
+                    result = self.save_secrets_bulk(batch, session)
+                    if result is None:
+                        raise ValueError("Не удалось сохранить порцию записей")
+                    saved += result[0]
+                    failures.update(result[1])
+            finally:
+                if isinstance(source, str):
+                    stream.close()
+            return saved, failures
+        except Exception as e:
+            print(f"Ошибка при загрузке архива (сохранено записей: {saved}): {e}")
+            return None
+
+    def backup(self, backup_dir, full=False, progress=None, keep_chains=None, max_deltas=None):
+        # Снимок в каталог резервных копий (backup.py) через отдельное соединение, поэтому работа
+        # с хранилищем не прерывается. Возвращает описание снимка или None.
+        from backup import BackupStore, DEFAULT_KEEP_CHAINS, DEFAULT_MAX_DELTAS
+        try:
+            store = BackupStore(backup_dir, keep_chains or DEFAULT_KEEP_CHAINS, max_deltas or DEFAULT_MAX_DELTAS)
+            return store.snapshot(self.db_path, full, progress)
+        except Exception as e:
+            print(f"Ошибка при резервном копировании: {e}")
+            return None
+
+    def iter_secrets(self, session, names=None, chunk_size=ITER_CHUNK_SIZE):
+        # Генератор (имя, данные): шифртексты читаются порциями через fetchmany и расшифровываются лениво,
+        # поэтому в памяти одновременно находится не больше chunk_size записей
+        session = self._resolve_session(session)
+        if session is None:
+            raise PermissionError("Сессия хранилища заблокирована")
+        if names is None:
+            with self._lock:
+                cursor = self._conn.execute('SELECT name, encrypted_data FROM secrets ORDER BY name')
+            yield from self._iter_decrypted(cursor, session, chunk_size)
+            return
+
+        names = iter(names)
+        while True:
+            batch = list(itertools.islice(names, chunk_size))
+            if not batch:
+                return
+            placeholders = ', '.join('?' * len(batch))
+            with self._lock:
+                cursor = self._conn.execute(
+                    f'SELECT name, encrypted_data FROM secrets WHERE name IN ({placeholders}) ORDER BY name',
+                    batch)
+            yield from self._iter_decrypted(cursor, session, chunk_size)
+
+    def _iter_decrypted(self, cursor, session, chunk_size):
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            for name, encrypted_data in rows:
+                yield name, json.loads(self._decrypt_data(encrypted_data, session))
+
+    def search_secrets(self, search_term='', limit=None, offset=0, secret_type=None, tag=None, host=None,
+                       folder=None):
+        # Результаты ранжируются: точное совпадение, затем префикс, затем подстрока; внутри группы по имени.
+        # Фильтры по типу, тегу и хосту идут по открытым индексируемым колонкам, без расшифровки.
+        limit = -1 if limit is None else limit
+        source, where, params = self._search_source(search_term, secret_type, tag, host, folder)
+        order, order_params = 's.name', ()
         if search_term:
-            cursor.execute('SELECT name FROM secrets WHERE name LIKE ? ORDER BY name',
-                           (f'%{search_term}%',))
-        else:
-            cursor.execute('SELECT name FROM secrets ORDER BY name')
-        results = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return results
+            escaped = _escape_like(search_term)
+            order = '''CASE WHEN s.name LIKE ? ESCAPE '\\' THEN 0
+                            WHEN s.name LIKE ? ESCAPE '\\' THEN 1 ELSE 2 END, s.name'''
+            order_params = (escaped, f'{escaped}%')
+        rows = self._fetchall(f'''
+            SELECT s.name FROM {source} {where}
+            ORDER BY {order}
+            LIMIT ? OFFSET ?
+        ''', (*params, *order_params, limit, offset))
+        return [row[0] for row in rows]
+
+    def count_secrets(self, search_term='', secret_type=None, tag=None, host=None, folder=None):
+        source, where, params = self._search_source(search_term, secret_type, tag, host, folder)
+        return self._fetchone(f'SELECT COUNT(*) FROM {source} {where}', params)[0]
+
+    def _search_source(self, search_term='', secret_type=None, tag=None, host=None, folder=None):
+        # Общие FROM и WHERE для search_secrets и count_secrets
+        source = 'secrets s'
+        conditions = []
+        params = []
+        # Унарный плюс отключает индекс колонки: если есть совпадения FTS, выборка идет от них,
+        # а не перебором всех строк нужного типа или хоста
+        column = 's.'
+        if search_term and self._fts_enabled and len(search_term) >= TRIGRAM_MIN_LENGTH:
+            conditions.append('s.id IN (SELECT rowid FROM secrets_fts WHERE secrets_fts MATCH ?)')
+            params.append(_fts_phrase(search_term))
+            column = '+s.'
+        elif search_term:
+            conditions.append("s.name LIKE ? ESCAPE '\\'")
+            params.append(f'%{_escape_like(search_term)}%')
+        if secret_type:
+            conditions.append(f'{column}type = ?')
+            params.append(secret_type)
+        if host:
+            conditions.append(f'{column}host = ?')
+            params.append(host)
+        if folder:
+            # Папка вместе с вложенными: диапазон ['a/', 'a0') по индексу, так как '0' следует за '/'
+            conditions.append(f'({column}folder = ? OR ({column}folder >= ? AND {column}folder < ?))')
+            params.extend((folder, f'{folder}/', f'{folder}0'))
+        if tag:
+            conditions.append('''s.id IN (
+                SELECT st.secret_id FROM secret_tags st JOIN tags t ON t.id = st.tag_id WHERE t.name = ?
+            )''')
+            params.append(tag)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return source, where, params
+
+    def facet_counts(self, only=None):
+        # Число секретов по типам, папкам и тегам: GROUP BY по индексам, без чтения записей.
+        # only={'tag': {...}, ...} пересчитывает только перечисленные значения (после сохранения
+        # или удаления); отсутствующие в результате значения получают 0.
+        queries = {
+            'type': '''SELECT type, COUNT(*) FROM secrets {where} GROUP BY type''',
+            'folder': '''SELECT folder, COUNT(*) FROM secrets
+                         WHERE folder IS NOT NULL {condition} GROUP BY folder''',
+            'tag': '''SELECT t.name, COUNT(*) FROM secret_tags st JOIN tags t ON t.id = st.tag_id
+                      {where} GROUP BY st.tag_id''',
+        }
+        columns = {'type': 'type', 'folder': 'folder', 'tag': 't.name'}
+        counts = {}
+        for kind, query in queries.items():
+            if only is None:
+                rows = self._fetchall(query.format(where='', condition=''))
+                counts[kind] = dict(rows)
+                continue
+            values = only.get(kind)
+            if not values:
+                continue
+            placeholders = ', '.join('?' * len(values))
+            condition = f'{columns[kind]} IN ({placeholders})'
+            rows = self._fetchall(query.format(where=f'WHERE {condition}', condition=f'AND {condition}'),
+                                  list(values))
+            counts[kind] = dict.fromkeys(values, 0)
+            counts[kind].update(rows)
+        return counts
+
+    def get_facets(self, name):
+        # Тип, папка и теги записи из открытых колонок: какие счетчики изменятся при сохранении или удалении
+        row = self._fetchone('SELECT id, type, folder FROM secrets WHERE name = ?', (name,))
+        if not row:
+            return {}
+        record_id, secret_type, folder = row
+        tags = self._fetchall('''
+            SELECT t.name FROM secret_tags st JOIN tags t ON t.id = st.tag_id WHERE st.secret_id = ?
+        ''', (record_id,))
+        facets = {'type': {secret_type}, 'tag': {tag for tag, in tags}}
+        if folder:
+            facets['folder'] = {folder}
+        return facets
 
     def delete_secret(self, name):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._transaction(immediate=True) as cursor:
+            if not self._delete_record(cursor, name):
+                return False
+            # Время удаления нужно синхронизации, чтобы сравнить удаление с изменениями на других копиях
+            self._log_changes(cursor, [('delete', name, None, utc_now(), None, None, None, None)])
+            return True
+
+    def _delete_record(self, cursor, name) -> bool:
+        cursor.execute('SELECT name, encrypted_data, updated_at FROM secrets WHERE name = ?', (name,))
+        previous = cursor.fetchall()
+        if not previous:
+            return False
         cursor.execute('DELETE FROM secrets WHERE name = ?', (name,))
-        conn.commit()
-        conn.close()
+        self._record_cache.invalidate([name])
+        self._update_merkle(cursor, previous, [])
+        return True
+
+    def verify_integrity(self, session):
+        # Корзины пересчитываются по записям (HMAC шифртекстов, без расшифровки) и сверяются с индексом
+        # спуском от корня. Возвращает {'ok', 'stale', 'buckets', 'names'} или None.
+        try:
+            session = self._resolve_session(session)
+            if session is None:
+                return None
+            key = merkle.merkle_key(session.data_key)
+            with self._lock:
+                cursor = self._conn.cursor()
+                if not merkle.is_current(cursor, key):
+                    return {'ok': False, 'stale': True, 'buckets': [], 'names': []}
+                levels = merkle.tree_levels(merkle.bucket_hashes(cursor, key))
+                stored = merkle.node_reader(cursor)
+                buckets = merkle.diff(stored, lambda level, position: levels[level][position])
+                return {
+                    'ok': merkle.root(cursor) == levels[-1][0],
+                    'stale': False,
+                    'buckets': buckets,
+                    'names': merkle.names_in_buckets(cursor, key, buckets),
+                }
+        except Exception as e:
+            print(f"Ошибка при проверке целостности: {e}")
+            return None
+
+    def compare_replicas(self, other_path, session):
+        # Сравнение с другой копией по индексам: O(k * log N) сравнений узлов для k расхождений.
+        # Возвращает {'equal', 'buckets', 'names'} или None.
+        try:
+            session = self._resolve_session(session)
+            if session is None:
+                return None
+            key = merkle.merkle_key(session.data_key)
+            other = sqlite3.connect(f'file:{other_path}?mode=ro', uri=True)
+            try:
+                other_cursor = other.cursor()
+                if not merkle.is_current(other_cursor, key):
+                    raise ValueError("Индекс другой копии устарел или построен под другой ключ данных")
+                with self._lock:
+                    cursor = self._conn.cursor()
+                    if not merkle.is_current(cursor, key):
+                        raise ValueError("Индекс этой копии устарел")
+                    buckets = merkle.diff(merkle.node_reader(cursor), merkle.node_reader(other_cursor))
+                    names = set(merkle.names_in_buckets(cursor, key, buckets))
+                names.update(merkle.names_in_buckets(other_cursor, key, buckets))
+            finally:
+                other.close()
+            return {'equal': not buckets, 'buckets': buckets, 'names': sorted(names)}
+        except Exception as e:
+            print(f"Ошибка при сравнении копий: {e}")
+            return None
 
-    def _derive_key(self, master_password: str, salt: bytes = None) -> tuple:
+    def _derive_key(self, master_password: str, salt: bytes = None, params: KdfParams = DEFAULT_KDF_PARAMS) -> tuple:
         if salt is None:
             salt = os.urandom(16)
-        key = base64.urlsafe_b64encode(hashlib.pbkdf2_hmac(
-            'sha256',
-            master_password.encode(),
-            salt,
-            100000,
-            32
-        ))
+        key = base64.urlsafe_b64encode(derive_kdf(master_password.encode(), salt, params))
         return key, salt
 
-    def _encrypt_data(self, data: str, master_password: str) -> bytes:
-        salt = os.urandom(16)
-        key, salt = self._derive_key(master_password, salt)
-        data_bytes = data.encode()
-        encrypted = bytearray()
-        key_bytes = base64.urlsafe_b64decode(key)
-        for i, byte in enumerate(data_bytes):
-            encrypted.append(byte ^ key_bytes[i % len(key_bytes)])
-        return salt + bytes(encrypted)
+    def _wrap_data_key(self, data_key: bytes, master_password: str, params: KdfParams = DEFAULT_KDF_PARAMS) -> tuple:
+        key, kek_salt = self._derive_key(master_password, params=params)
+        return kek_salt, self._encrypt_with_key(data_key, base64.urlsafe_b64decode(key))
+
+    def _unwrap_data_key(self, wrapped_key: bytes, kek_salt: bytes, master_password: str,
+                         params: KdfParams = DEFAULT_KDF_PARAMS) -> bytes:
+        key, _ = self._derive_key(master_password, kek_salt, params)
+        return self._decrypt_with_key(wrapped_key, base64.urlsafe_b64decode(key))
+
+    def _encrypt_with_key(self, data: bytes, data_key: bytes) -> bytes:
+        return DEFAULT_CIPHER.encrypt(data, data_key)
+
+    def _decrypt_with_key(self, encrypted_data: bytes, data_key: bytes) -> bytes:
+        if not encrypted_data:
+            raise ValueError("Пустая запись")
+        return get_cipher(encrypted_data[0]).decrypt(encrypted_data, data_key)
+
+    def _encrypt_data(self, data: str, session: VaultSession) -> bytes:
+        return self._encrypt_with_key(data.encode(), session.data_key)
+
+    def _decrypt_data(self, encrypted_data: bytes, session: VaultSession) -> str:
+        try:
+            return self._decrypt_with_key(encrypted_data, session.data_key).decode()
+        except PermissionError:
+            raise
+        except Exception:
+            raise ValueError("Неверный мастер-пароль или поврежденные данные")
 
-    def _decrypt_data(self, encrypted_data: bytes, master_password: str) -> str:
+    def _decrypt_legacy_data(self, encrypted_data: bytes, master_password: str) -> bytes:
         try:
             salt = encrypted_data[:16]
             actual_data = encrypted_data[16:]
             key, _ = self._derive_key(master_password, salt)
-            decrypted = bytearray()
             key_bytes = base64.urlsafe_b64decode(key)
-            for i, byte in enumerate(actual_data):
-                decrypted.append(byte ^ key_bytes[i % len(key_bytes)])
-            return decrypted.decode()
+            pad = (key_bytes * (len(actual_data) // len(key_bytes) + 1))[:len(actual_data)]
+            decrypted = _xor_bytes(actual_data, pad)
+            # Старый формат не аутентифицирован: неверный ключ видно только по битому UTF-8
+            decrypted.decode()
+            return decrypted
         except Exception:
             raise ValueError("Неверный мастер-пароль или поврежденные данные")
 
-    def _hash_password(self, password: str, salt: bytes = None) -> tuple:
+    def _hash_password(self, password: str, salt: bytes = None, params: KdfParams = DEFAULT_KDF_PARAMS) -> tuple:
         if salt is None:
             salt = os.urandom(16)
-        password_hash = hashlib.pbkdf2_hmac(
-            'sha256',
-            password.encode(),
-            salt,
-            100000
-        )
+        password_hash = derive_kdf(password.encode(), salt, params)
         return base64.b64encode(password_hash).decode(), salt
 
-    def _verify_password(self, password: str, stored_hash: str, salt: bytes) -> bool:
+    def _verify_password(self, password: str, stored_hash: str, salt: bytes,
+                         params: KdfParams = DEFAULT_KDF_PARAMS) -> bool:
         try:
-            new_hash, _ = self._hash_password(password, salt)
-            return new_hash == stored_hash
+            new_hash, _ = self._hash_password(password, salt, params)
+            # Сравнение за постоянное время, чтобы не выдавать совпадающий префикс хэша
+            return hmac.compare_digest(base64.b64decode(new_hash), base64.b64decode(stored_hash))
         except:
             return False
@@ -1,5 +1,6 @@
 import tkinter as tk
 from tkinter import messagebox
+from secret_types import SECRET_TYPES, DEFAULT_SECRET_TYPE, SecretField, get_secret_type, parse_folder, parse_tags
 
 
 class PasswordDialog:
@@ -118,7 +119,7 @@ class AddSecretDialog:
     def create_dialog(self):
         dialog = tk.Toplevel(self.parent)
         dialog.title("Добавить новый секрет")
-        dialog.geometry("500x350")
+        dialog.geometry("520x560")
         dialog.transient(self.parent)
         dialog.grab_set()
         dialog.configure(bg=self.theme["bg_secondary"])
@@ -130,31 +131,26 @@ class AddSecretDialog:
         y = (screen_height - dialog.winfo_height()) // 2
         dialog.geometry(f"+{x}+{y}")
 
-        fields = [
-            ("Название:*", "name", True, False),
-            ("Хост:", "host", False, False),
-            ("Логин:*", "username", True, False),
-            ("Пароль:*", "password", True, True)
-        ]
+        tk.Label(dialog, text="Тип:", bg=self.theme["bg_secondary"], fg=self.theme["fg"],
+                 font=("Arial", 11)).grid(row=0, column=0, sticky=tk.W, padx=12, pady=10)
 
-        self.entries = {}
-
-        for i, (label, field_name, required, is_password) in enumerate(fields):
-            tk.Label(dialog, text=label, bg=self.theme["bg_secondary"], fg=self.theme["fg"],
-                     font=("Arial", 11)).grid(
-                row=i, column=0, sticky=tk.W, padx=12, pady=10)
+        self.type_var = tk.StringVar(value=SECRET_TYPES[DEFAULT_SECRET_TYPE].title)
+        type_menu = tk.OptionMenu(dialog, self.type_var,
+                                  *[secret_type.title for secret_type in SECRET_TYPES.values()],
+                                  command=lambda _: self.build_fields())
+        type_menu.config(bg=self.theme["entry_bg"], fg=self.theme["entry_fg"], relief="flat",
+                         highlightthickness=0, font=("Arial", 11))
+        type_menu.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=12, pady=10)
 
-            show_char = "*" if is_password else None
-            entry = tk.Entry(dialog, width=32, bg=self.theme["entry_bg"], fg=self.theme["entry_fg"],
-                             insertbackground=self.theme["cursor_color"], relief="flat",
-                             show=show_char, font=("Arial", 11))
-            entry.grid(row=i, column=1, sticky=(tk.W, tk.E), padx=12, pady=10)
-            self.entries[field_name] = entry
+        self.fields_frame = tk.Frame(dialog, bg=self.theme["bg_secondary"])
+        self.fields_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E))
+        self.entries = {}
+        self.build_fields()
 
         self.entries["name"].focus()
 
         btn_frame = tk.Frame(dialog, bg=self.theme["bg_secondary"])
-        btn_frame.grid(row=4, column=0, columnspan=2, pady=20)
+        btn_frame.grid(row=2, column=0, columnspan=2, pady=20)
 
         # Увеличиваем ширину кнопок и уменьшаем шрифт для лучшего размещения текста
         save_btn = tk.Button(btn_frame, text="Сохранить", bg="#007bff", fg="white",
@@ -167,37 +163,74 @@ class AddSecretDialog:
                                font=("Arial", 10), width=12, height=1)  # Уменьшен шрифт и задана ширина
         cancel_btn.grid(row=0, column=1, padx=8, ipadx=5, ipady=2)  # Добавлены внутренние отступы
 
-        dialog.bind('<Return>', lambda e: self.save(dialog))
+        # В многострочных полях Enter переводит строку, а не сохраняет
+        dialog.bind('<Return>', lambda e: None if isinstance(e.widget, tk.Text) else self.save(dialog))
         dialog.columnconfigure(1, weight=1)
         self.parent.wait_window(dialog)
 
+    def build_fields(self):
+        # Набор полей зависит от типа; совпадающие поля (название, хост, логин, папка, теги) сохраняют значения
+        values = {field_name: self.get_value(field_name) for field_name in self.entries}
+        for child in self.fields_frame.winfo_children():
+            child.destroy()
+        self.entries = {}
+
+        secret_type = get_secret_type(self.type_var.get())
+        self.fields = [SecretField("Название", "name", True, False, False), *secret_type.fields,
+                       SecretField("Папка (team/prod)", "folder", False, False, False),
+                       SecretField("Теги (через запятую)", "tags", False, False, False)]
+
+        for i, field in enumerate(self.fields):
+            label = f"{field.label}:{'*' if field.required else ''}"
+            tk.Label(self.fields_frame, text=label, bg=self.theme["bg_secondary"], fg=self.theme["fg"],
+                     font=("Arial", 11)).grid(
+                row=i, column=0, sticky=tk.NW if field.multiline else tk.W, padx=12, pady=6)
+
+            value = values.get(field.name, "")
+            if field.multiline:
+                entry = tk.Text(self.fields_frame, width=32, height=4, bg=self.theme["entry_bg"],
+                                fg=self.theme["entry_fg"], insertbackground=self.theme["cursor_color"],
+                                relief="flat", font=("Arial", 11))
+                entry.insert("1.0", value)
+            else:
+                show_char = "*" if field.secret else None
+                entry = tk.Entry(self.fields_frame, width=32, bg=self.theme["entry_bg"], fg=self.theme["entry_fg"],
+                                 insertbackground=self.theme["cursor_color"], relief="flat",
+                                 show=show_char, font=("Arial", 11))
+                entry.insert(0, value)
+            entry.grid(row=i, column=1, sticky=(tk.W, tk.E), padx=12, pady=6)
+            self.entries[field.name] = entry
+
+        self.fields_frame.columnconfigure(1, weight=1)
+
+    def get_value(self, field_name):
+        entry = self.entries[field_name]
+        if isinstance(entry, tk.Text):
+            return entry.get("1.0", "end-1c")
+        return entry.get()
+
     def save(self, dialog):
-        name = self.entries["name"].get().strip()
-        host = self.entries["host"].get().strip()
-        username = self.entries["username"].get().strip()
-        password = self.entries["password"].get()
-
-        if not name:
-            messagebox.showerror("Ошибка", "Введите название секрета")
-            self.entries["name"].focus()
-            return
-
-        if not username:
-            messagebox.showerror("Ошибка", "Введите логин")
-            self.entries["username"].focus()
-            return
-
-        if not password:
-            messagebox.showerror("Ошибка", "Введите пароль")
-            self.entries["password"].focus()
-            return
-
-        secret_data = {
-            'host': host,
-            'username': username,
-            'password': password,
-            'type': 'Database'
-        }
+        secret_type = get_secret_type(self.type_var.get())
+        secret_data = {'type': secret_type.title}
+
+        for field in self.fields:
+            value = self.get_value(field.name)
+            # Секретные значения (пароли, ключи) не обрезаем: пробелы могут быть их частью
+            if not field.secret:
+                value = value.strip()
+            if field.required and not value:
+                messagebox.showerror("Ошибка", f"Заполните поле «{field.label}»")
+                self.entries[field.name].focus()
+                return
+            secret_data[field.name] = value
+
+        name = secret_data.pop('name')
+        folder = parse_folder(secret_data.pop('folder'))
+        if folder:
+            secret_data['folder'] = folder
+        tags = parse_tags(secret_data.pop('tags'))
+        if tags:
+            secret_data['tags'] = tags
 
         self.result = (name, secret_data)
-        dialog.destroy()
\ No newline at end of file
+        dialog.destroy()
@@ -1,21 +1,55 @@
+import argparse
+import json
+import sys
+import time
 import tkinter as tk
-from app import SecretWallet
+from database import Database
+from ui_components import LockScreen
 
 
-def main():
+def main(argv=None):
+    started = time.perf_counter()
+    parser = argparse.ArgumentParser(description="Хранилище секретов")
+    parser.add_argument("--db", default="secrets.db", help="путь к файлу хранилища")
+    parser.add_argument("--startup-probe", action="store_true",
+                        help="вывести время до первого кадра и выйти (для benchmark.py startup)")
+    args = parser.parse_args(argv)
+
     try:
 
+        # Хранилище открывается и экран блокировки рисуется до загрузки app и диалогов,
+        # чтобы окно появлялось сразу, а остальной интерфейс подгружался за ним
+        db = Database(args.db)
+
         root = tk.Tk()
+        root.title("🔐 Storage of Secrets")
+        lock_screen = LockScreen(root)
+        root.update()
+        first_frame = time.perf_counter()
+
+        from app import SecretWallet
+
+        if args.startup_probe:
+            print(json.dumps({
+                "first_frame_ms": (first_frame - started) * 1000,
+                "ui_ready_ms": (time.perf_counter() - started) * 1000,
+            }))
+            db.close()
+            root.destroy()
+            return 0
 
-        app = SecretWallet(root)
+        app = SecretWallet(root, db=db, lock_screen=lock_screen)
 
         root.mainloop()
 
     except Exception as e:
 
         print(f"Критическая ошибка при запуске приложения: {e}")
+        if args.startup_probe:
+            return 1
         input("Нажмите Enter для выхода...")
+    return 0
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import hashlib
+import hmac
+
+
+# Индекс целостности: лист записи — HMAC от (name, encrypted_data, updated_at) на ключе, выведенном
+# из ключа данных. Листья распределяются по MERKLE_BUCKETS корзинам (тоже по ключу) и складываются
+# XOR, поэтому изменение записи — это XOR старого и нового листа в одной корзине. Над корзинами —
+# двоичное дерево sha256 высотой MERKLE_DEPTH: запись обновляет MERKLE_DEPTH узлов до корня.
+# Таблица merkle_nodes: level 0 — корзины, level MERKLE_DEPTH — корень.
+MERKLE_DEPTH = 12
+MERKLE_BUCKETS = 1 << MERKLE_DEPTH
+HASH_SIZE = 32
+EMPTY_HASH = bytes(HASH_SIZE)
+REBUILD_BATCH_SIZE = 5000
+
+
+def merkle_key(data_key: bytes) -> bytes:
+    return hmac.new(data_key, b"merkle index", hashlib.sha256).digest()
+
+
+def key_check(key: bytes) -> str:
+    # Отпечаток ключа индекса: по нему видно, что индекс построен под текущий ключ данных
+    return hmac.new(key, b"merkle key check", hashlib.sha256).hexdigest()
+
+
+def bucket_of(key: bytes, name: str) -> int:
+    digest = hmac.new(key, b"bucket\0" + name.encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:4], 'big') % MERKLE_BUCKETS
+
+
+def leaf_hash(key: bytes, name: str, encrypted_data: bytes, updated_at) -> bytes:
+    name_bytes = name.encode()
+    message = len(name_bytes).to_bytes(4, 'big') + name_bytes + str(updated_at).encode() + b"\0" + encrypted_data
+    return hmac.new(key, message, hashlib.sha256).digest()
+
+
+def _xor(a: bytes, b: bytes) -> bytes:
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(HASH_SIZE, 'big')
+
+
+def _parent(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(left + right).digest()
+
+
+def is_current(cursor, key: bytes) -> bool:
+    cursor.execute('SELECT key_check FROM merkle_meta WHERE id = 1')
+    row = cursor.fetchone()
+    return row is not None and row[0] == key_check(key)
+
+
+def invalidate(cursor):
+    # Изменение без ключа (хранилище заблокировано): индекс перестраивается при следующей разблокировке
+    cursor.execute('DELETE FROM merkle_meta')
+
+
+def root(cursor) -> bytes:
+    cursor.execute('SELECT hash FROM merkle_nodes WHERE level = ? AND position = 0', (MERKLE_DEPTH,))
+    row = cursor.fetchone()
+    return row[0] if row else EMPTY_HASH
+
+
+def _node(cursor, level, position) -> bytes:
+    cursor.execute('SELECT hash FROM merkle_nodes WHERE level = ? AND position = ?', (level, position))
+    row = cursor.fetchone()
+    return row[0] if row else EMPTY_HASH
+
+
+def _write_nodes(cursor, level, nodes):
+    cursor.executemany('INSERT OR REPLACE INTO merkle_nodes (level, position, hash) VALUES (?, ?, ?)',
+                       ((level, position, node) for position, node in nodes.items()))
+
+
+def bucket_hashes(cursor, key: bytes, batch_size=REBUILD_BATCH_SIZE) -> list:
+    # Корзины, пересчитанные по самим записям: полный проход без расшифровки, только HMAC шифртекстов
+    buckets = [0] * MERKLE_BUCKETS
+    reader = cursor.connection.execute('SELECT name, encrypted_data, updated_at FROM secrets')
+    while True:
+        rows = reader.fetchmany(batch_size)
+        if not rows:
+            break
+        for name, encrypted_data, updated_at in rows:
+            buckets[bucket_of(key, name)] ^= int.from_bytes(leaf_hash(key, name, encrypted_data, updated_at), 'big')
+    return [bucket.to_bytes(HASH_SIZE, 'big') for bucket in buckets]
+
+
+def tree_levels(buckets) -> list:
+    levels = [list(buckets)]
+    for _ in range(MERKLE_DEPTH):
+        below = levels[-1]
+        levels.append([_parent(below[i], below[i + 1]) for i in range(0, len(below), 2)])
+    return levels
+
+
+def rebuild(cursor, key: bytes):
+    cursor.execute('DELETE FROM merkle_nodes')
+    for level, nodes in enumerate(tree_levels(bucket_hashes(cursor, key))):
+        _write_nodes(cursor, level, dict(enumerate(nodes)))
+    cursor.execute('INSERT OR REPLACE INTO merkle_meta (id, key_check) VALUES (1, ?)', (key_check(key),))
+
+
+def update(cursor, key: bytes, removed, added):
+    # removed/added: [(name, encrypted_data, updated_at)] — прежние и новые версии записей.
+    # Меняются только затронутые корзины и их предки.
+    deltas = {}
+    for name, encrypted_data, updated_at in list(removed) + list(added):
+        bucket = bucket_of(key, name)
+        deltas[bucket] = _xor(deltas.get(bucket, EMPTY_HASH), leaf_hash(key, name, encrypted_data, updated_at))
+    if not deltas:
+        return
+    nodes = {bucket: _xor(_node(cursor, 0, bucket), delta) for bucket, delta in deltas.items()}
+    _write_nodes(cursor, 0, nodes)
+    for level in range(1, MERKLE_DEPTH + 1):
+        parents = {}
+        for position in {position >> 1 for position in nodes}:
+            left = nodes.get(2 * position) or _node(cursor, level - 1, 2 * position)
+            right = nodes.get(2 * position + 1) or _node(cursor, level - 1, 2 * position + 1)
+            parents[position] = _parent(left, right)
+        _write_nodes(cursor, level, parents)
+        nodes = parents
+
+
+def node_reader(cursor):
+    return lambda level, position: _node(cursor, level, position)
+
+
+def diff(read_a, read_b) -> list:
+    # Спуск от корня только по различающимся узлам: для k расхождений — O(k * MERKLE_DEPTH) сравнений.
+    # read_a/read_b(level, position) возвращают хэш узла (node_reader или уровни tree_levels).
+    positions = [0]
+    for level in range(MERKLE_DEPTH, -1, -1):
+        differing = [position for position in positions if read_a(level, position) != read_b(level, position)]
+        if level == 0 or not differing:
+            return differing
+        positions = [child for position in differing for child in (2 * position, 2 * position + 1)]
+    return []
+
+
+def names_in_buckets(cursor, key: bytes, buckets) -> list:
+    buckets = set(buckets)
+    if not buckets:
+        return []
+    reader = cursor.connection.execute('SELECT name FROM secrets ORDER BY name')
+    return [name for (name,) in reader if bucket_of(key, name) in buckets]
@@ -0,0 +1,323 @@
+import json
+import os
+import sqlite3
+from collections import namedtuple
+
+from secret_types import DEFAULT_SECRET_TYPE, extract_metadata
+
+
+MIGRATION_BATCH_SIZE = 1000
+MIGRATION_WORKERS = min(8, os.cpu_count() or 1)
+
+# needs_key: шаг перешифровывает записи и получает мастер-пароль, поэтому может выполниться
+# только при разблокировке. Пока такой шаг ждет пароля, следующие за ним тоже не применяются.
+Migration = namedtuple('Migration', ['version', 'description', 'apply', 'needs_key'])
+
+
+class MasterPasswordRequired(Exception):
+    pass
+
+
+def _iter_batches(cursor, condition='', params=(), batch_size=MIGRATION_BATCH_SIZE):
+    # Постраничное чтение по ключу id: в памяти не больше batch_size записей, а обновление
+    # уже прочитанных строк не сбивает выборку
+    reader = cursor.connection.cursor()
+    last_id = 0
+    while True:
+        reader.execute(f'''
+            SELECT id, encrypted_data FROM secrets
+            WHERE id > ?{condition}
+            ORDER BY id LIMIT ?
+        ''', (last_id, *params, batch_size))
+        rows = reader.fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def _create_base_schema(db, cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS secrets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            encrypted_data BLOB NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS master_password (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            password_hash TEXT NOT NULL,
+            salt BLOB NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            kdf TEXT NOT NULL DEFAULT 'pbkdf2_sha256',
+            iterations INTEGER NOT NULL DEFAULT 100000,
+            memory_cost INTEGER,
+            parallelism INTEGER
+        )
+    ''')
+    # Хранилища, созданные до появления параметров KDF, получают значения по умолчанию
+    cursor.execute('PRAGMA table_info(master_password)')
+    columns = {row[1] for row in cursor.fetchall()}
+    for column, definition in (('kdf', "TEXT NOT NULL DEFAULT 'pbkdf2_sha256'"),
+                               ('iterations', 'INTEGER NOT NULL DEFAULT 100000'),
+                               ('memory_cost', 'INTEGER'),
+                               ('parallelism', 'INTEGER')):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE master_password ADD COLUMN {column} {definition}')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vault_keys (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            kek_salt BLOB NOT NULL,
+            wrapped_key BLOB NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _create_search_index(db, cursor):
+    # Триграммный FTS5-индекс по названиям, синхронизируется триггерами.
+    # Если сборка SQLite без FTS5/trigram, шаг пропускается и поиск работает через LIKE.
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'secrets_fts'")
+    if cursor.fetchone():
+        return
+    cursor.execute('SAVEPOINT search_index')
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE secrets_fts USING fts5(
+                name, content='secrets', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER secrets_fts_insert AFTER INSERT ON secrets BEGIN
+                INSERT INTO secrets_fts (rowid, name) VALUES (new.id, new.name);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER secrets_fts_delete AFTER DELETE ON secrets BEGIN
+                INSERT INTO secrets_fts (secrets_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER secrets_fts_update AFTER UPDATE OF name ON secrets BEGIN
+                INSERT INTO secrets_fts (secrets_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                INSERT INTO secrets_fts (rowid, name) VALUES (new.id, new.name);
+            END
+        ''')
+        cursor.execute("INSERT INTO secrets_fts (secrets_fts) VALUES ('rebuild')")
+    except sqlite3.OperationalError as e:
+        cursor.execute('ROLLBACK TO search_index')
+        print(f"Полнотекстовый индекс недоступен, используется LIKE: {e}")
+    cursor.execute('RELEASE search_index')
+
+
+def _reencrypt_legacy_records(db, cursor, master_password):
+    # Хранилища до появления ключа данных шифровали каждую запись ключом, выведенным из мастер-пароля
+    # со своей солью. Записи перешифровываются ключом данных; PBKDF2 отпускает GIL, поэтому
+    # вывод ключей по каждой порции идет в пуле потоков.
+    cursor.execute('SELECT 1 FROM vault_keys WHERE id = 1')
+    if cursor.fetchone():
+        return
+    cursor.execute('SELECT 1 FROM secrets LIMIT 1')
+    if not cursor.fetchone():
+        # Записей нет: ключ данных создаст первая разблокировка
+        return
+    if master_password is None:
+        raise MasterPasswordRequired()
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    data_key = db._create_data_key(cursor, master_password)
+
+    def reencrypt(row):
+        record_id, encrypted_data = row
+        return db._encrypt_with_key(db._decrypt_legacy_data(encrypted_data, master_password), data_key), record_id
+
+    with ThreadPoolExecutor(max_workers=MIGRATION_WORKERS) as executor:
+        for rows in _iter_batches(cursor):
+            cursor.executemany('UPDATE secrets SET encrypted_data = ? WHERE id = ?', executor.map(reencrypt, rows))
+
+
+def _removed_step(db, cursor):
+    # Шаг 4 переводил записи с неаутентифицированного формата 1, который удален. Номер шага
+    # сохранен, чтобы не сдвигать user_version уже обновленных хранилищ.
+    pass
+
+
+def _add_metadata_columns(db, cursor):
+    # Несекретные метаданные открытым текстом: фильтры по типу, хосту и тегам без расшифровки
+    cursor.execute(f"ALTER TABLE secrets ADD COLUMN type TEXT NOT NULL DEFAULT '{DEFAULT_SECRET_TYPE}'")
+    cursor.execute('ALTER TABLE secrets ADD COLUMN host TEXT')
+    cursor.execute('CREATE INDEX idx_secrets_type ON secrets (type, name)')
+    cursor.execute('CREATE INDEX idx_secrets_host ON secrets (host, name)')
+    cursor.execute('''
+        CREATE TABLE tags (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE COLLATE NOCASE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE secret_tags (
+            secret_id INTEGER NOT NULL,
+            tag_id INTEGER NOT NULL,
+            PRIMARY KEY (tag_id, secret_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX idx_secret_tags_secret ON secret_tags (secret_id)')
+    cursor.execute('''
+        CREATE TRIGGER secrets_tags_delete AFTER DELETE ON secrets BEGIN
+            DELETE FROM secret_tags WHERE secret_id = old.id;
+        END
+    ''')
+
+
+def _backfill_metadata(db, cursor, master_password):
+    # Метаданные существующих записей лежат только в зашифрованном JSON
+    cursor.execute('SELECT 1 FROM secrets LIMIT 1')
+    if not cursor.fetchone():
+        return
+    if master_password is None:
+        raise MasterPasswordRequired()
+
+    data_key = db._load_data_key(master_password)
+    for rows in _iter_batches(cursor):
+        columns, tags = [], []
+        for record_id, encrypted_data in rows:
+            secret_data = json.loads(db._decrypt_with_key(encrypted_data, data_key))
+            metadata = extract_metadata(secret_data)
+            columns.append((metadata.type, metadata.host, record_id))
+            tags.append((record_id, metadata.tags))
+        cursor.executemany('UPDATE secrets SET type = ?, host = ? WHERE id = ?', columns)
+        cursor.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)',
+                           ((tag,) for _, record_tags in tags for tag in record_tags))
+        cursor.executemany('''
+            INSERT OR IGNORE INTO secret_tags (secret_id, tag_id) SELECT ?, id FROM tags WHERE name = ?
+        ''', ((record_id, tag) for record_id, record_tags in tags for tag in record_tags))
+
+
+def _add_folder_column(db, cursor):
+    # Папка появилась позже тегов, в старых записях ее нет, поэтому заполнять нечего
+    cursor.execute('ALTER TABLE secrets ADD COLUMN folder TEXT')
+    cursor.execute('CREATE INDEX idx_secrets_folder ON secrets (folder, name)')
+
+
+def _add_updated_at_index(db, cursor):
+    # Дельты резервных копий выбирают записи, измененные после предыдущего снимка
+    cursor.execute('CREATE INDEX idx_secrets_updated_at ON secrets (updated_at)')
+
+
+def _add_change_log(db, cursor):
+    # Журнал изменений для синхронизации копий хранилища: только добавление, seq монотонен.
+    # Существующие записи попадают в журнал как вставки, чтобы новая копия получила все состояние.
+    replica_id = os.urandom(8).hex()
+    cursor.execute('''
+        CREATE TABLE change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT NOT NULL,
+            name TEXT NOT NULL,
+            encrypted_data BLOB,
+            updated_at TEXT NOT NULL,
+            origin TEXT NOT NULL,
+            type TEXT,
+            host TEXT,
+            folder TEXT,
+            tags TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX idx_change_log_name ON change_log (name, seq)')
+    cursor.execute('''
+        CREATE TABLE replica (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            replica_id TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT INTO replica (id, replica_id) VALUES (1, ?)', (replica_id,))
+    # received_seq — до какого seq применен журнал копии, acked_seq — до какого она подтвердила наш
+    cursor.execute('''
+        CREATE TABLE sync_peers (
+            peer_id TEXT PRIMARY KEY,
+            received_seq INTEGER NOT NULL DEFAULT 0,
+            acked_seq INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO change_log (op, name, encrypted_data, updated_at, origin, type, host, folder, tags)
+        SELECT 'insert', s.name, s.encrypted_data, s.updated_at, ?, s.type, s.host, s.folder,
+               (SELECT json_group_array(t.name) FROM secret_tags st JOIN tags t ON t.id = st.tag_id
+                WHERE st.secret_id = s.id)
+        FROM secrets s ORDER BY s.id
+    ''', (replica_id,))
+
+
+def _add_merkle_index(db, cursor):
+    # Узлы строятся при разблокировке: листья считаются на ключе, выведенном из ключа данных
+    cursor.execute('''
+        CREATE TABLE merkle_nodes (
+            level INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            hash BLOB NOT NULL,
+            PRIMARY KEY (level, position)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE merkle_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            key_check TEXT NOT NULL
+        )
+    ''')
+
+
+def _add_key_generation(db, cursor):
+    # Поколение ключа данных растет при его замене: сессии со старым ключом отклоняются
+    cursor.execute('ALTER TABLE vault_keys ADD COLUMN key_generation INTEGER NOT NULL DEFAULT 0')
+
+
+def _compact_change_log(db, cursor):
+    # Журнал хранил все версии шифртекста, включая удаленные записи. Остается последнее изменение
+    # каждой записи, удаление — отметка без данных; уникальный индекс по имени держит журнал сжатым.
+    cursor.execute('DELETE FROM change_log WHERE seq NOT IN (SELECT MAX(seq) FROM change_log GROUP BY name)')
+    cursor.execute("UPDATE change_log SET encrypted_data = NULL WHERE op = 'delete'")
+    cursor.execute('DROP INDEX idx_change_log_name')
+    cursor.execute('CREATE UNIQUE INDEX idx_change_log_name ON change_log (name)')
+
+
+MIGRATIONS = [
+    Migration(1, "базовая схема", _create_base_schema, False),
+    Migration(2, "полнотекстовый индекс по названиям", _create_search_index, False),
+    Migration(3, "перешифровка записей старого формата ключом данных", _reencrypt_legacy_records, True),
+    Migration(4, "удаленный шаг (формат записей 1)", _removed_step, False),
+    Migration(5, "колонки метаданных и теги", _add_metadata_columns, False),
+    Migration(6, "заполнение метаданных из зашифрованных записей", _backfill_metadata, True),
+    Migration(7, "папки", _add_folder_column, False),
+    Migration(8, "индекс по времени изменения", _add_updated_at_index, False),
+    Migration(9, "журнал изменений для синхронизации", _add_change_log, False),
+    Migration(10, "индекс целостности (дерево Меркла)", _add_merkle_index, False),
+    Migration(11, "поколение ключа данных", _add_key_generation, False),
+    Migration(12, "сжатие журнала изменений", _compact_change_log, False),
+]
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+def migrate(db, master_password=None) -> int:
+    # Каждый шаг — отдельная транзакция вместе с записью PRAGMA user_version: прерванная миграция
+    # откатывается целиком и повторяется при следующем открытии
+    version = db.schema_version()
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        try:
+            with db._transaction(immediate=True) as cursor:
+                # Пока ждали блокировку записи, шаг мог выполнить другой процесс
+                cursor.execute('PRAGMA user_version')
+                if cursor.fetchone()[0] < migration.version:
+                    if migration.needs_key:
+                        migration.apply(db, cursor, master_password)
+                    else:
+                        migration.apply(db, cursor)
+                    cursor.execute(f'PRAGMA user_version = {migration.version}')
+        except MasterPasswordRequired:
+            break
+        version = migration.version
+    return version
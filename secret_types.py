@@ -0,0 +1,75 @@
+from collections import namedtuple
+
+
+# secret: поле маскируется в интерфейсе; multiline: вводится многострочным полем (ключи, сертификаты)
+SecretField = namedtuple('SecretField', ['label', 'name', 'required', 'secret', 'multiline'])
+SecretType = namedtuple('SecretType', ['key', 'title', 'fields'])
+SecretMetadata = namedtuple('SecretMetadata', ['type', 'host', 'folder', 'tags'])
+
+SECRET_TYPES = {
+    'database': SecretType('database', 'Database', [
+        SecretField("Хост", "host", False, False, False),
+        SecretField("Порт", "port", False, False, False),
+        SecretField("База данных", "database", False, False, False),
+        SecretField("Логин", "username", True, False, False),
+        SecretField("Пароль", "password", True, True, False),
+    ]),
+    'ssh_key': SecretType('ssh_key', 'SSH key', [
+        SecretField("Хост", "host", False, False, False),
+        SecretField("Логин", "username", True, False, False),
+        SecretField("Приватный ключ", "private_key", True, True, True),
+        SecretField("Парольная фраза", "passphrase", False, True, False),
+    ]),
+    'api_token': SecretType('api_token', 'API token', [
+        SecretField("Хост / URL", "host", False, False, False),
+        SecretField("Токен", "token", True, True, False),
+    ]),
+    'certificate': SecretType('certificate', 'Certificate', [
+        SecretField("Хост", "host", False, False, False),
+        SecretField("Сертификат", "certificate", True, False, True),
+        SecretField("Приватный ключ", "private_key", False, True, True),
+    ]),
+}
+DEFAULT_SECRET_TYPE = 'database'
+
+
+def get_secret_type(value) -> SecretType:
+    # Принимает ключ или название типа; старые записи хранят 'type': 'Database'
+    if isinstance(value, str):
+        normalized = value.strip().lower()
+        for secret_type in SECRET_TYPES.values():
+            if normalized in (secret_type.key, secret_type.title.lower()):
+                return secret_type
+    return SECRET_TYPES[DEFAULT_SECRET_TYPE]
+
+
+def parse_tags(value) -> list:
+    # Теги из строки "prod, db" или списка; повторы без учета регистра отбрасываются
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    tags = []
+    seen = set()
+    for tag in value:
+        tag = str(tag).strip()
+        if tag and tag.lower() not in seen:
+            seen.add(tag.lower())
+            tags.append(tag)
+    return tags
+
+
+def parse_folder(value):
+    # Путь папки вида "team/prod": лишние и крайние "/" и пробелы убираются, пустой путь — без папки
+    if not value:
+        return None
+    parts = [part.strip() for part in str(value).split('/')]
+    return '/'.join(part for part in parts if part) or None
+
+
+def extract_metadata(secret_data) -> SecretMetadata:
+    # Несекретные поля, которые дублируются открытым текстом в индексируемых колонках
+    secret_type = get_secret_type(secret_data.get('type'))
+    host = str(secret_data.get('host') or '').strip() or None
+    return SecretMetadata(secret_type.key, host, parse_folder(secret_data.get('folder')),
+                          parse_tags(secret_data.get('tags')))
@@ -0,0 +1,194 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+
+from database import VaultSession, parse_timestamp
+
+
+# Синхронизация копий хранилища через файлы изменений. Файл — JSON Lines: заголовок (копия-источник,
+# с какого seq выгружено, что источник уже получил от других копий), записи журнала изменений
+# с шифртекстами и итоговая строка. Копии должны разделять ключ данных (быть копиями одного
+# хранилища), расшифровка при синхронизации не нужна. Конфликты решаются по updated_at в UTC:
+# побеждает более позднее изменение, при равенстве — большее имя копии.
+CHANGESET_FORMAT = "swchanges"
+CHANGESET_VERSION = 1
+CHANGESET_SUFFIX = ".changes"
+SYNC_BATCH_SIZE = 1000
+
+
+class SyncError(Exception):
+    pass
+
+
+class SyncGapError(SyncError):
+    pass
+
+
+def key_id(session: VaultSession) -> str:
+    # Отпечаток ключа данных, по которому сверяется, что копии шифруют записи одним ключом
+    return hmac.new(session.data_key, b"sync key id", hashlib.sha256).hexdigest()[:32]
+
+
+def _require_change_log(db):
+    if db.replica_id is None:
+        raise SyncError("Журнал изменений недоступен: хранилище не обновлено до актуальной схемы")
+
+
+def reset_replica(db) -> str:
+    # Копия, полученная копированием файла хранилища, наследует его replica_id; перед первой
+    # синхронизацией ей нужен собственный, иначе копии примут изменения друг друга за свои
+    _require_change_log(db)
+    replica_id = os.urandom(8).hex()
+    with db._transaction(immediate=True) as cursor:
+        cursor.execute('UPDATE replica SET replica_id = ? WHERE id = 1', (replica_id,))
+        cursor.execute('DELETE FROM sync_peers')
+    db.replica_id = replica_id
+    return replica_id
+
+
+def export_changes(db, session, path, peer_id=None) -> int:
+    # Выгружает изменения, которые копия peer_id еще не подтвердила (без peer_id — весь журнал).
+    # Возвращает число выгруженных записей журнала.
+    _require_change_log(db)
+    with db._lock:
+        since = 0
+        if peer_id is not None:
+            row = db._fetchone('SELECT acked_seq FROM sync_peers WHERE peer_id = ?', (peer_id,))
+            since = row[0] if row else 0
+        return _write_changeset(db, session, path, since)
+
+
+def _write_changeset(db, session, path, since):
+    temp_path = f'{path}.tmp'
+    seen = dict(db._fetchall('SELECT peer_id, received_seq FROM sync_peers'))
+    header = {"format": CHANGESET_FORMAT, "version": CHANGESET_VERSION, "replica": db.replica_id,
+              "key_id": key_id(session), "since": since, "seen": seen}
+    count = 0
+    last_seq = since
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as stream:
+            stream.write(json.dumps(header) + "\n")
+            cursor = db._conn.execute('''
+                SELECT seq, op, name, encrypted_data, updated_at, origin, type, host, folder, tags
+                FROM change_log WHERE seq > ? ORDER BY seq
+            ''', (since,))
+            while True:
+                rows = cursor.fetchmany(SYNC_BATCH_SIZE)
+                if not rows:
+                    break
+                for seq, op, name, encrypted_data, updated_at, origin, secret_type, host, folder, tags in rows:
+                    stream.write(json.dumps({
+                        "seq": seq, "op": op, "name": name,
+                        "data": base64.b64encode(encrypted_data).decode() if encrypted_data is not None else None,
+                        "updated_at": updated_at, "origin": origin, "type": secret_type, "host": host,
+                        "folder": folder, "tags": json.loads(tags) if tags is not None else None,
+                    }, ensure_ascii=False) + "\n")
+                last_seq = rows[-1][0]
+                count += len(rows)
+            stream.write(json.dumps({"end": last_seq, "count": count}) + "\n")
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return count
+
+
+def import_changes(db, session, path) -> tuple:
+    # Применяет файл изменений одной транзакцией: обрезанный или чужой файл не меняет хранилище.
+    # Возвращает (применено, пропущено как устаревшие).
+    _require_change_log(db)
+    applied = 0
+    skipped = 0
+    with open(path, 'r', encoding='utf-8') as stream:
+        try:
+            header = json.loads(stream.readline())
+        except ValueError:
+            raise SyncError(f"Файл {path} не является файлом изменений")
+        if header.get("format") != CHANGESET_FORMAT or header.get("version") != CHANGESET_VERSION:
+            raise SyncError(f"Файл {path} не является файлом изменений поддерживаемой версии")
+        peer_id = header["replica"]
+        if peer_id == db.replica_id:
+            raise SyncError("Файл изменений выгружен этой же копией")
+        if header["key_id"] != key_id(session):
+            raise SyncError("Копии зашифрованы разными ключами данных")
+
+        with db._transaction(immediate=True) as cursor:
+            # Сессия со старым ключом данных (до rekey) приняла бы записи под ключом, которого нет
+            db._check_session_key(session, cursor)
+            cursor.execute('SELECT received_seq FROM sync_peers WHERE peer_id = ?', (peer_id,))
+            row = cursor.fetchone()
+            if header["since"] > (row[0] if row else 0):
+                raise SyncGapError("В журнале копии пропуск: выгрузите изменения заново без --peer")
+            trailer = None
+            count = 0
+            for line in stream:
+                entry = json.loads(line)
+                if "end" in entry:
+                    trailer = entry
+                    break
+                count += 1
+                if _is_newer(cursor, entry):
+                    _apply_entry(db, cursor, entry)
+                    applied += 1
+                else:
+                    skipped += 1
+            if trailer is None or trailer["count"] != count:
+                raise SyncError("Файл изменений обрезан")
+
+            cursor.execute('''
+                INSERT INTO sync_peers (peer_id, received_seq, acked_seq) VALUES (?, ?, ?)
+                ON CONFLICT (peer_id) DO UPDATE SET
+                    received_seq = max(received_seq, excluded.received_seq),
+                    acked_seq = max(acked_seq, excluded.acked_seq)
+            ''', (peer_id, trailer["end"], header["seen"].get(db.replica_id, 0)))
+    return applied, skipped
+
+
+def _is_newer(cursor, entry) -> bool:
+    # Последнее известное изменение записи, включая удаление, — единственная строка журнала с этим
+    # именем (поиск по уникальному индексу). Время сравнивается после приведения к UTC: строки старых
+    # версий записаны по местному времени без смещения
+    cursor.execute('SELECT updated_at, origin FROM change_log WHERE name = ?', (entry["name"],))
+    row = cursor.fetchone()
+    return row is None or (parse_timestamp(entry["updated_at"]), entry["origin"]) > (parse_timestamp(row[0]), row[1])
+
+
+def _apply_entry(db, cursor, entry):
+    name = entry["name"]
+    if entry["op"] == "delete":
+        # Удаление записывается в журнал, даже если записи здесь нет: оно должно дойти до других копий
+        db._delete_record(cursor, name)
+        db._log_changes(cursor, [("delete", name, None, entry["updated_at"], None, None, None, None)],
+                        entry["origin"])
+        return
+    db._upsert_records(cursor, [(name, base64.b64decode(entry["data"]), entry["updated_at"], entry["type"],
+                                 entry["host"], entry["folder"], entry["tags"] or [])], entry["origin"])
+
+
+def sync_directory(db, session, directory) -> dict:
+    # Общий каталог (сетевая папка, синхронизируемый диск): каждая копия пишет свой файл
+    # <replica_id>.changes и применяет файлы остальных. Выгружается часть журнала, которую
+    # еще не подтвердили все известные по каталогу копии.
+    _require_change_log(db)
+    os.makedirs(directory, exist_ok=True)
+    peers = [file_name[:-len(CHANGESET_SUFFIX)] for file_name in sorted(os.listdir(directory))
+             if file_name.endswith(CHANGESET_SUFFIX) and file_name[:-len(CHANGESET_SUFFIX)] != db.replica_id]
+
+    result = {"peers": {}, "waiting": []}
+    for peer_id in peers:
+        try:
+            result["peers"][peer_id] = import_changes(db, session, os.path.join(directory, peer_id + CHANGESET_SUFFIX))
+        except SyncGapError:
+            # Копия выгрузила журнал до того, как узнала о нас; полный журнал она выгрузит,
+            # когда увидит наш файл в каталоге
+            result["waiting"].append(peer_id)
+
+    with db._lock:
+        acked = dict(db._fetchall('SELECT peer_id, acked_seq FROM sync_peers'))
+        since = min((acked.get(peer_id, 0) for peer_id in peers), default=0)
+        path = os.path.join(directory, db.replica_id + CHANGESET_SUFFIX)
+        result["exported"] = _write_changeset(db, session, path, since)
+    return result
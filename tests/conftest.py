@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import KDF_PBKDF2, Database, KdfParams  # noqa: E402
+
+
+PASSWORD = "master"
+# Тестам не нужна стойкость KDF, только скорость
+FAST_KDF = KdfParams(KDF_PBKDF2, 1000, None, None)
+
+
+def create_vault(path, password=PASSWORD):
+    db = Database(str(path))
+    assert db.set_master_password(password, FAST_KDF)
+    return db
+
+
+@pytest.fixture
+def vault(tmp_path):
+    db = create_vault(tmp_path / "vault.db")
+    session = db.unlock(PASSWORD)
+    assert session is not None
+    yield db, session
+    session.lock()
+    db.close()
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from backup import SNAPSHOT_DELTA, SNAPSHOT_FULL, BackupError, BackupStore
+from conftest import PASSWORD
+from database import Database
+
+
+def _restore(store, path, snapshot_name=None):
+    store.restore(str(path), snapshot_name)
+    db = Database(str(path))
+    return db, db.unlock(PASSWORD)
+
+
+def test_full_and_delta_restore(vault, tmp_path):
+    db, session = vault
+    store = BackupStore(str(tmp_path / "backups"))
+    assert db.save_secret("kept", {"password": "k"}, session)
+    assert db.save_secret("changed", {"password": "v1"}, session)
+    assert db.save_secret("deleted", {"password": "d"}, session)
+    full = store.snapshot(db.db_path)
+    assert full.kind == SNAPSHOT_FULL
+
+    assert db.save_secret("changed", {"password": "v2", "tags": ["prod"]}, session)
+    assert db.save_secret("added", {"password": "a"}, session)
+    db.delete_secret("deleted")
+    delta = store.snapshot(db.db_path)
+    assert delta.kind == SNAPSHOT_DELTA
+    assert delta.parent == os.path.basename(full.path)
+
+    restored, restored_session = _restore(store, tmp_path / "restored.db")
+    assert restored_session is not None
+    assert {name: restored.get_secret(name, restored_session) for name in restored.search_secrets()} == {
+        "kept": {"password": "k"},
+        "changed": {"password": "v2", "tags": ["prod"]},
+        "added": {"password": "a"},
+    }
+    assert restored.count_secrets(tag="prod") == 1
+    assert restored.verify_integrity(restored_session)["ok"]
+    restored.close()
+
+    earlier, earlier_session = _restore(store, tmp_path / "earlier.db", os.path.basename(full.path))
+    assert earlier.get_secret("deleted", earlier_session) == {"password": "d"}
+    assert earlier.get_secret("changed", earlier_session) == {"password": "v1"}
+    earlier.close()
+
+
+def test_restore_does_not_overwrite_existing_file(vault, tmp_path):
+    db, session = vault
+    store = BackupStore(str(tmp_path / "backups"))
+    store.snapshot(db.db_path)
+
+    with pytest.raises(BackupError):
+        store.restore(db.db_path)
@@ -0,0 +1,49 @@
+import sqlite3
+
+from conftest import PASSWORD
+
+
+def _tamper(path, query, params=()):
+    # Правка файла в обход Database, как при повреждении или подмене записи
+    conn = sqlite3.connect(path)
+    conn.execute(query, params)
+    conn.commit()
+    conn.close()
+
+
+def _flip_last_byte(blob):
+    return blob[:-1] + bytes([blob[-1] ^ 1])
+
+
+def test_wrong_password_is_rejected(vault):
+    db, session = vault
+    assert db.save_secret("mail", {"password": "p1"}, session)
+
+    assert db.unlock("wrong") is None
+    assert db.unlock("") is None
+    assert db.get_secret("mail", "wrong") is None
+    assert db.unlock(PASSWORD) is not None
+
+
+def test_tampered_record_is_rejected(vault):
+    db, session = vault
+    assert db.save_secret("mail", {"password": "p1"}, session)
+    assert db.save_secret("other", {"password": "p2"}, session)
+    encrypted = db._fetchone("SELECT encrypted_data FROM secrets WHERE name = 'mail'")[0]
+
+    # Новый updated_at, чтобы запись не отдалась из кэша расшифрованных записей
+    _tamper(db.db_path, "UPDATE secrets SET encrypted_data = ?, updated_at = '2000-01-01' WHERE name = 'mail'",
+            (_flip_last_byte(encrypted),))
+    assert db.get_secret("mail", session) is None
+    assert db.get_secret("other", session) == {"password": "p2"}
+    report = db.verify_integrity(session)
+    assert not report["ok"]
+    assert "mail" in report["names"]
+
+
+def test_tampered_data_key_is_rejected(vault):
+    db, session = vault
+    wrapped_key = db._fetchone("SELECT wrapped_key FROM vault_keys WHERE id = 1")[0]
+
+    _tamper(db.db_path, "UPDATE vault_keys SET wrapped_key = ? WHERE id = 1", (_flip_last_byte(wrapped_key),))
+    assert db.unlock(PASSWORD) is None
@@ -0,0 +1,97 @@
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+
+from database import Database
+from migrations import SCHEMA_VERSION
+
+BASELINE_PASSWORD = "admin"
+
+
+def _baseline_key(password, salt):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000, 32)
+
+
+def create_baseline_vault(path, password, secrets):
+    # Файл в формате первой версии: без user_version, пароль — PBKDF2 с солью, каждая запись
+    # зашифрована XOR ключом из пароля со своей солью
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE secrets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            encrypted_data BLOB NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE master_password (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            password_hash TEXT NOT NULL,
+            salt BLOB NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    salt = os.urandom(16)
+    conn.execute('INSERT INTO master_password (id, password_hash, salt) VALUES (1, ?, ?)',
+                 (base64.b64encode(_baseline_key(password, salt)).decode(), salt))
+    for name, data in secrets.items():
+        salt = os.urandom(16)
+        key = _baseline_key(password, salt)
+        encrypted = bytes(byte ^ key[i % len(key)] for i, byte in enumerate(json.dumps(data).encode()))
+        conn.execute('INSERT INTO secrets (name, encrypted_data, updated_at) VALUES (?, ?, ?)',
+                     (name, salt + encrypted, '2024-01-02 03:04:05.000000'))
+    conn.commit()
+    conn.close()
+
+
+def _user_version(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_baseline_vault_migrates_to_latest_schema(tmp_path):
+    path = str(tmp_path / "baseline.db")
+    secrets = {
+        "mail": {"host": "api.example.org", "token": "t1", "type": "API token"},
+        "db": {"host": "db.example.org", "password": "p2", "type": "Database"},
+    }
+    create_baseline_vault(path, BASELINE_PASSWORD, secrets)
+
+    with Database(path) as db:
+        # Без пароля выполняются только шаги, которым не нужен ключ
+        assert _user_version(path) < SCHEMA_VERSION
+        session = db.unlock(BASELINE_PASSWORD)
+        assert session is not None
+        assert _user_version(path) == SCHEMA_VERSION
+        for name, data in secrets.items():
+            assert db.get_secret(name, session) == data
+        assert db.search_secrets("mai") == ["mail"]
+        # Метаданные для фильтров восстановлены из зашифрованных записей
+        assert db.count_secrets(secret_type="api_token") == 1
+        assert db.count_secrets(host="db.example.org") == 1
+        assert db.verify_integrity(session)["ok"]
+        session.lock()
+
+    # Повторное открытие уже обновленного файла ничего не меняет
+    with Database(path) as db:
+        session = db.unlock(BASELINE_PASSWORD)
+        assert db.get_secret("mail", session) == secrets["mail"]
+
+
+def test_baseline_vault_is_not_migrated_with_wrong_password(tmp_path):
+    path = str(tmp_path / "baseline.db")
+    create_baseline_vault(path, BASELINE_PASSWORD, {"mail": {"password": "p1"}})
+
+    with Database(path) as db:
+        version = _user_version(path)
+        assert db.unlock("wrong") is None
+        assert _user_version(path) == version
+        session = db.unlock(BASELINE_PASSWORD)
+        assert db.get_secret("mail", session) == {"password": "p1"}
@@ -0,0 +1,78 @@
+import threading
+
+import database
+from conftest import PASSWORD
+
+
+def _ciphertexts(db):
+    return dict(db._fetchall('SELECT name, encrypted_data FROM secrets'))
+
+
+def test_rotation_keeps_data_key(vault):
+    db, session = vault
+    assert db.save_secret("mail", {"password": "p1"}, session)
+    before = _ciphertexts(db)
+
+    new_session = db.rotate_master_password(PASSWORD, "new")
+    assert new_session is not None
+    assert db.unlock(PASSWORD) is None
+    assert db.unlock("new") is not None
+    # Перешифрован только ключ данных: записи и открытые сессии остаются действительными
+    assert _ciphertexts(db) == before
+    assert db.get_secret("mail", session) == {"password": "p1"}
+
+
+def test_rotation_with_rekey(vault, monkeypatch):
+    db, session = vault
+    # Порции меньше числа записей, чтобы перешифровка шла в пуле процессов
+    monkeypatch.setattr(database, "REKEY_CHUNK_SIZE", 10)
+    db.save_secrets_bulk([(f"record-{i}", {"password": str(i)}) for i in range(50)], session)
+    db.delete_secret("record-0")
+    before = _ciphertexts(db)
+    progress = []
+
+    new_session = db.rotate_master_password(PASSWORD, "new", lambda done, total: progress.append((done, total)),
+                                            rekey=True, workers=2)
+    assert new_session is not None
+    assert progress[-1] == (49, 49)
+    after = _ciphertexts(db)
+    assert after.keys() == before.keys()
+    assert all(after[name] != before[name] for name in before)
+    assert db.get_secret("record-7", new_session) == {"password": "7"}
+    assert db.verify_integrity(new_session)["ok"]
+
+    # Сессия со старым ключом данных отклоняется и блокируется
+    assert db.get_secret("record-7", session) is None
+    assert not session.is_unlocked
+    assert not db.save_secret("record-1", {"password": "x"}, session)
+
+    # В журнале изменений только последняя версия записи под новым ключом, удаление — без данных
+    log = dict(db._fetchall('SELECT name, encrypted_data FROM change_log'))
+    assert log["record-0"] is None
+    assert all(log[name] == after[name] for name in after)
+
+
+
+def test_save_with_old_session_during_rekey_is_rejected(vault):
+    db, session = vault
+    db.save_secrets_bulk([(f"record-{i}", {"password": str(i)}) for i in range(200)], session)
+    started = threading.Event()
+    result = {}
+
+    def slow_progress(done, total):
+        # Перешифровка держит блокировку записи, пока сохранение ждет ее
+        started.set()
+        threading.Event().wait(0.3)
+
+    rotation = threading.Thread(target=lambda: result.setdefault(
+        "session", db.rotate_master_password(PASSWORD, "new", slow_progress, rekey=True, workers=1)))
+    rotation.start()
+    assert started.wait(5)
+    saved = db.save_secret("victim", {"password": "x"}, session)
+    rotation.join()
+
+    new_session = result["session"]
+    assert new_session is not None
+    assert not saved
+    assert db.get_secret("victim", new_session) is None
+    assert db.get_secret("record-7", new_session) == {"password": "7"}
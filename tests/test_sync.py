@@ -0,0 +1,76 @@
+import shutil
+
+import pytest
+
+from conftest import PASSWORD, create_vault
+from database import Database
+from sync import SyncError, export_changes, import_changes, reset_replica, sync_directory
+
+
+@pytest.fixture
+def replicas(vault, tmp_path):
+    # Вторая копия — копия файла того же хранилища (общий ключ данных) со своим replica_id
+    db, session = vault
+    assert db.save_secret("shared", {"password": "v1"}, session)
+    db._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    shutil.copy(db.db_path, tmp_path / "replica.db")
+    other = Database(str(tmp_path / "replica.db"))
+    reset_replica(other)
+    other_session = other.unlock(PASSWORD)
+    yield (db, session), (other, other_session)
+    other_session.lock()
+    other.close()
+
+
+def _sync(directory, *replicas):
+    # Два прохода: на первом копии узнают друг о друге, на втором забирают изменения
+    for _ in range(2):
+        for db, session in replicas:
+            sync_directory(db, session, str(directory))
+
+
+def test_two_replica_round_trip(replicas, tmp_path):
+    (a, a_session), (b, b_session) = replicas
+    assert a.save_secret("from-a", {"password": "a"}, a_session)
+    assert b.save_secret("from-b", {"password": "b", "tags": ["prod"]}, b_session)
+    assert b.save_secret("shared", {"password": "v2"}, b_session)
+    a.delete_secret("shared")
+
+    _sync(tmp_path / "sync", (a, a_session), (b, b_session))
+
+    for db, session in ((a, a_session), (b, b_session)):
+        assert db.get_secret("from-a", session) == {"password": "a"}
+        assert db.get_secret("from-b", session) == {"password": "b", "tags": ["prod"]}
+        # Удаление в A позже изменения в B: побеждает удаление
+        assert db.get_secret("shared", session) is None
+        assert db.count_secrets(tag="prod") == 1
+        assert db.verify_integrity(session)["ok"]
+
+
+def test_newer_change_wins(replicas, tmp_path):
+    (a, a_session), (b, b_session) = replicas
+    assert a.save_secret("shared", {"password": "old"}, a_session)
+    assert b.save_secret("shared", {"password": "new"}, b_session)
+
+    path = str(tmp_path / "b.changes")
+    export_changes(b, b_session, path)
+    assert import_changes(a, a_session, path)[0] >= 1
+    export_changes(a, a_session, str(tmp_path / "a.changes"))
+    assert import_changes(b, b_session, str(tmp_path / "a.changes"))[0] == 0
+
+    assert a.get_secret("shared", a_session) == {"password": "new"}
+    assert b.get_secret("shared", b_session) == {"password": "new"}
+
+
+def test_changes_from_another_vault_are_rejected(vault, tmp_path):
+    db, session = vault
+    other = create_vault(tmp_path / "other.db")
+    other_session = other.unlock(PASSWORD)
+    assert other.save_secret("foreign", {"password": "x"}, other_session)
+    path = str(tmp_path / "other.changes")
+    export_changes(other, other_session, path)
+
+    with pytest.raises(SyncError):
+        import_changes(db, session, path)
+    assert db.get_secret("foreign", session) is None
+    other.close()
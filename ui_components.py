@@ -1,4 +1,330 @@
 import tkinter as tk
+import tkinter.font as tkfont
+from tkinter import ttk
+from bisect import bisect_left
+from collections import OrderedDict
+
+
+# Если изменений больше, дешевле перерисовать список целиком одним вызовом insert
+MAX_LISTBOX_DIFF_OPS = 200
+VIRTUAL_LIST_PAGE_SIZE = 200
+VIRTUAL_LIST_CACHED_PAGES = 8
+VIRTUAL_LIST_LOADING_TEXT = "…"
+# Строка страницы, которая еще загружается
+_PENDING = object()
+
+
+def diff_ranges(old, new):
+    # Диф двух списков уникальных строк за O(n log n): строки из наибольшей возрастающей
+    # подпоследовательности старых позиций остаются на месте, остальное удаляется/вставляется.
+    # Возвращает [(i1, i2, j1, j2)]: old[i1:i2] заменить на new[j1:j2]
+    if old == new:
+        return []
+    old_index = {name: i for i, name in enumerate(old)}
+    pairs = [(old_index[name], j) for j, name in enumerate(new) if name in old_index]
+
+    tails = []
+    tails_pos = []
+    parents = [-1] * len(pairs)
+    for k, (i, _) in enumerate(pairs):
+        pos = bisect_left(tails, i)
+        parents[k] = tails_pos[pos - 1] if pos else -1
+        if pos == len(tails):
+            tails.append(i)
+            tails_pos.append(k)
+        else:
+            tails[pos] = i
+            tails_pos[pos] = k
+
+    anchors = []
+    k = tails_pos[-1] if tails_pos else -1
+    while k != -1:
+        anchors.append(pairs[k])
+        k = parents[k]
+    anchors.reverse()
+    anchors.append((len(old), len(new)))
+
+    ranges = []
+    prev_i, prev_j = 0, 0
+    for i, j in anchors:
+        if i > prev_i or j > prev_j:
+            ranges.append((prev_i, i, prev_j, j))
+        prev_i, prev_j = i + 1, j + 1
+    return ranges
+
+
+def update_listbox(listbox, old, new):
+    # Обновляет Listbox до new, трогая только изменившиеся диапазоны. Выделение и прокрутку
+    # восстанавливает вызывающий код: он знает, какие строки видны
+    ranges = diff_ranges(old, new)
+    if len(ranges) > MAX_LISTBOX_DIFF_OPS:
+        listbox.delete(0, tk.END)
+        if new:
+            listbox.insert(tk.END, *new)
+    else:
+        # С конца, чтобы индексы еще не обработанных диапазонов не сдвигались
+        for i1, i2, j1, j2 in reversed(ranges):
+            if i2 > i1:
+                listbox.delete(i1, i2 - 1)
+            if j2 > j1:
+                listbox.insert(i1, *new[j1:j2])
+
+
+class VirtualList(tk.Frame):
+    # Список, который держит в Listbox только видимые строки. Данные запрашиваются страницами
+    # через fetch(offset, limit, deliver), поэтому память и перерисовка не зависят от размера хранилища.
+    # fetch не ждет БД: страница отдается позже вызовом deliver(rows) в потоке Tk, а до этого
+    # на месте ее строк показывается заглушка.
+    def __init__(self, parent, listbox_options=None, scrollbar_options=None,
+                 page_size=VIRTUAL_LIST_PAGE_SIZE, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.page_size = page_size
+        self._count = 0
+        self._fetch = None
+        self._pages = OrderedDict()
+        self._loading = set()
+        # Номер источника: страницы, запрошенные до смены источника, отбрасываются
+        self._source = 0
+        self._check_selection = False
+        self._top = 0
+        self._rows = []
+        self._selected_name = None
+        self._selected_index = None
+
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar,
+                                      **(scrollbar_options or {}))
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox = tk.Listbox(self, **(listbox_options or {}))
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        # Шрифт задается при создании и не меняется: метрики строки читаются из одного объекта
+        self._font = tkfont.Font(font=self.listbox.cget('font'))
+
+        self.listbox.bind('<<ListboxSelect>>', self._on_listbox_select)
+        self.listbox.bind('<Configure>', lambda e: self._render())
+        self.listbox.bind('<MouseWheel>', self._on_mousewheel)
+        self.listbox.bind('<Button-4>', lambda e: self._scroll_by(-3))
+        self.listbox.bind('<Button-5>', lambda e: self._scroll_by(3))
+        self.listbox.bind('<Up>', lambda e: self._move_selection(-1))
+        self.listbox.bind('<Down>', lambda e: self._move_selection(1))
+        self.listbox.bind('<Prior>', lambda e: self._move_selection(-self._visible_rows()))
+        self.listbox.bind('<Next>', lambda e: self._move_selection(self._visible_rows()))
+
+    def set_source(self, count, fetch):
+        self._count = count
+        self._fetch = fetch
+        self._pages.clear()
+        self._loading.clear()
+        self._source += 1
+        self._selected_index = None
+        # Выделение переживает смену источника, только если запись осталась на экране:
+        # это проверяется, когда видимые страницы загрузятся
+        self._check_selection = True
+        self._top = max(0, min(self._top, count - self._visible_rows()))
+        self._render()
+
+    def selected_name(self):
+        return self._selected_name
+
+    def _visible_rows(self):
+        line_height = self._font.metrics('linespace') + 1 + 2 * int(self.listbox.cget('selectborderwidth'))
+        padding = 2 * (int(self.listbox.cget('borderwidth')) + int(self.listbox.cget('highlightthickness')))
+        height = self.listbox.winfo_height()
+        if height <= 1:
+            return int(self.listbox.cget('height'))
+        return max(1, (height - padding) // line_height)
+
+    def _row(self, index):
+        page_number = index // self.page_size
+        page = self._pages.get(page_number)
+        if page is None:
+            self._request_page(page_number)
+            page = self._pages.get(page_number)
+            if page is None:
+                return _PENDING
+        self._pages.move_to_end(page_number)
+        offset = index - page_number * self.page_size
+        return page[offset] if offset < len(page) else None
+
+    def _request_page(self, page_number):
+        if page_number in self._loading or self._fetch is None:
+            return
+        self._loading.add(page_number)
+        source = self._source
+
+        def deliver(rows):
+            if source != self._source:
+                return
+            self._loading.discard(page_number)
+            self._pages[page_number] = rows
+            while len(self._pages) > VIRTUAL_LIST_CACHED_PAGES:
+                self._pages.popitem(last=False)
+            self._render()
+
+        self._fetch(page_number * self.page_size, self.page_size, deliver)
+
+    def _render(self):
+        visible = self._visible_rows()
+        end = min(self._count, self._top + visible + 1)
+        rows = [name for name in (self._row(i) for i in range(self._top, end)) if name is not None]
+        if _PENDING in rows or _PENDING in self._rows:
+            # Заглушки одинаковы, а диф рассчитан на уникальные строки
+            self.listbox.delete(0, tk.END)
+            if rows:
+                self.listbox.insert(tk.END, *(VIRTUAL_LIST_LOADING_TEXT if name is _PENDING else name
+                                              for name in rows))
+        else:
+            update_listbox(self.listbox, self._rows, rows)
+        self._rows = rows
+        if self._check_selection and _PENDING not in rows:
+            self._check_selection = False
+            if self._selected_name not in rows:
+                self._selected_name = None
+
+        self.listbox.selection_clear(0, tk.END)
+        if self._selected_name in rows:
+            row = rows.index(self._selected_name)
+            self._selected_index = self._top + row
+            self.listbox.selection_set(row)
+
+        if self._count:
+            self.scrollbar.set(self._top / self._count, min(1.0, (self._top + visible) / self._count))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _scroll_to(self, top):
+        top = max(0, min(int(top), self._count - self._visible_rows()))
+        if top != self._top:
+            self._top = top
+            self._render()
+
+    def _scroll_by(self, rows):
+        self._scroll_to(self._top + rows)
+        return "break"
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self._scroll_to(float(amount) * self._count)
+        elif action == 'scroll':
+            step = self._visible_rows() if unit == 'pages' else 1
+            self._scroll_by(int(amount) * step)
+
+    def _on_mousewheel(self, event):
+        return self._scroll_by(-3 if event.delta > 0 else 3)
+
+    def _on_listbox_select(self, event=None):
+        selection = self.listbox.curselection()
+        if not selection or selection[0] >= len(self._rows) or self._rows[selection[0]] is _PENDING:
+            return
+        self._selected_index = self._top + selection[0]
+        self._selected_name = self._rows[selection[0]]
+        self.event_generate('<<ListboxSelect>>')
+
+    def _move_selection(self, delta):
+        if not self._count:
+            return "break"
+        current = self._selected_index if self._selected_index is not None else self._top - 1
+        index = max(0, min(self._count - 1, current + delta))
+        visible = self._visible_rows()
+        if index < self._top:
+            self._top = index
+        elif index >= self._top + visible:
+            self._top = index - visible + 1
+        name = self._row(index)
+        if name is not None and name is not _PENDING:
+            self._selected_index = index
+            self._selected_name = name
+        self._render()
+        self.event_generate('<<ListboxSelect>>')
+        return "break"
+
+
+class FacetPane(tk.Frame):
+    # Дерево фильтров с числом секретов: разделы (типы, папки, теги) и значения в них.
+    # Папки вида "team/prod" раскладываются по уровням, у родителя сумма по всем вложенным.
+    # Счетчики обновляются точечно через update_counts, дерево целиком не перестраивается.
+    ALL = "all"
+
+    def __init__(self, parent, sections, labels=None, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.labels = labels or {}
+        self._counts = {kind: {} for kind, _ in sections}
+
+        self.tree = ttk.Treeview(self, show="tree", selectmode="browse", style="Facet.Treeview")
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.scrollbar.set)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.tree.insert("", tk.END, iid=self.ALL, text="Все секреты")
+        for kind, title in sections:
+            self.tree.insert("", tk.END, iid=kind, text=title, open=True)
+        self.tree.bind("<<TreeviewSelect>>", lambda e: self.event_generate("<<FacetSelect>>"))
+
+    def apply_theme(self, theme):
+        style = ttk.Style(self)
+        style.configure("Facet.Treeview", background=theme["listbox_bg"], fieldbackground=theme["listbox_bg"],
+                        foreground=theme["listbox_fg"], font=("Arial", 11), rowheight=24)
+        style.map("Facet.Treeview", background=[("selected", theme["accent"])],
+                  foreground=[("selected", theme["button_fg"])])
+
+    def set_counts(self, counts):
+        # Полная загрузка: {раздел: {значение: число}}
+        for kind, values in counts.items():
+            self.tree.delete(*self.tree.get_children(kind))
+            self._counts[kind] = {}
+            self.update_counts(kind, values)
+
+    def update_counts(self, kind, values):
+        counts = self._counts[kind]
+        for value, count in values.items():
+            if count:
+                counts[value] = count
+            else:
+                counts.pop(value, None)
+        paths = set()
+        for value in values:
+            paths.update(self._paths(kind, value))
+        # Родители раньше детей: вставке нужен существующий родительский узел
+        for path in sorted(paths, key=lambda path: path.count("/")):
+            self._refresh_node(kind, path)
+
+    def selected(self):
+        # (раздел, значение) выбранного фильтра или (None, None) для «Все секреты» и заголовков разделов
+        selection = self.tree.selection()
+        if not selection or ":" not in selection[0]:
+            return None, None
+        kind, value = selection[0].split(":", 1)
+        return kind, value
+
+    def _paths(self, kind, value):
+        if kind != "folder":
+            return [value]
+        parts = value.split("/")
+        return ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+    def _total(self, kind, path):
+        counts = self._counts[kind]
+        if kind != "folder":
+            return counts.get(path, 0)
+        prefix = path + "/"
+        return sum(count for value, count in counts.items() if value == path or value.startswith(prefix))
+
+    def _refresh_node(self, kind, path):
+        iid = f"{kind}:{path}"
+        total = self._total(kind, path)
+        if not total:
+            if self.tree.exists(iid):
+                self.tree.delete(iid)
+            return
+
+        label = path.rsplit("/", 1)[-1] if kind == "folder" else path
+        text = f"{self.labels.get(kind, lambda value: value)(label)} ({total})"
+        if self.tree.exists(iid):
+            self.tree.item(iid, text=text)
+            return
+        parent = f"{kind}:{path.rsplit('/', 1)[0]}" if kind == "folder" and "/" in path else kind
+        siblings = [child.split(":", 1)[1].lower() for child in self.tree.get_children(parent)]
+        self.tree.insert(parent, bisect_left(siblings, path.lower()), iid=iid, text=text)
 
 
 class LockScreen: